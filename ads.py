@@ -0,0 +1,182 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from telegram.error import BadRequest, Forbidden, TelegramError
+
+from db import (
+    schedule_ads_order,
+    get_scheduled_ads,
+    get_scheduled_ad,
+    mark_ad_published,
+    mark_ad_failed,
+    mark_ad_expired
+)
+
+# package name -> (seconds on the channel, pinned)
+AD_DURATIONS = {
+    "1 soat": (3600, False),
+    "6 soat": (6 * 3600, False),
+    "24 soat": (24 * 3600, False),
+    "Pinned 24 soat": (24 * 3600, True),
+}
+
+RETRY_DELAY = 60
+MAX_ATTEMPTS = 10
+
+PUBLISH = "publish"
+EXPIRE = "expire"
+
+
+class AdScheduler:
+    def __init__(self, channel, admin_chat_id):
+        self.channel = channel
+        self.admin_chat_id = admin_chat_id
+        self.bot = None
+        self._heap = []
+        self._attempts = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _push(self, when, order_id, action):
+        heapq.heappush(self._heap, (when, next(self._seq), order_id, action))
+        self._wakeup.set()
+
+    async def schedule(self, order_id, package, publish_at=None):
+        seconds, _ = AD_DURATIONS[package]
+        publish_at = int(publish_at or time.time())
+        expires_at = publish_at + seconds
+
+        if not await schedule_ads_order(order_id, publish_at, expires_at):
+            return None
+
+        self._push(publish_at, order_id, PUBLISH)
+        return expires_at
+
+    async def start(self, application):
+        self.bot = application.bot
+        for order_id, status, publish_at, expires_at in await get_scheduled_ads():
+            if status == "scheduled":
+                self._push(publish_at, order_id, PUBLISH)
+            else:
+                self._push(expires_at, order_id, EXPIRE)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                print("AD SCHEDULER STOPPED WITH ERROR:", e)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, order_id, action = heapq.heappop(self._heap)
+            key = (order_id, action)
+            try:
+                if action == PUBLISH:
+                    await self._publish(order_id)
+                else:
+                    await self._expire(order_id)
+                self._attempts.pop(key, None)
+            except Exception as e:
+                attempts = self._attempts.pop(key, 0) + 1
+                print("AD SCHEDULER ERROR:", order_id, action, attempts, repr(e))
+                # Forbidden (no rights in the channel) and BadRequest will not
+                # fix themselves; anything else gets MAX_ATTEMPTS tries.
+                if isinstance(e, (BadRequest, Forbidden)) or attempts >= MAX_ATTEMPTS:
+                    await self._give_up(order_id, action, e)
+                else:
+                    self._attempts[key] = attempts
+                    self._push(time.time() + RETRY_DELAY, order_id, action)
+
+    async def _give_up(self, order_id, action, error):
+        try:
+            if action == PUBLISH:
+                await mark_ad_failed(order_id)
+                text = f"❌ Reklama (ID: {order_id}) kanalga joylanmadi:\n{error}"
+            else:
+                await mark_ad_expired(order_id)
+                text = f"⚠️ Reklama (ID: {order_id}) kanaldan o‘chirilmadi, uni qo‘lda o‘chiring:\n{error}"
+            await self.bot.send_message(chat_id=self.admin_chat_id, text=text)
+        except Exception as e:
+            print("AD SCHEDULER GIVE UP ERROR:", order_id, action, repr(e))
+
+    async def _publish(self, order_id):
+        order = await get_scheduled_ad(order_id)
+        if not order or order[4] != "scheduled":
+            return
+
+        oid, uid, package, ad_text, status, publish_at, expires_at, message_id = order
+        _, pinned = AD_DURATIONS.get(package, (0, False))
+
+        message = await self.bot.send_message(chat_id=self.channel, text=ad_text)
+
+        # The paid time starts when the ad actually appears, not when it was
+        # approved, so retries and downtime do not eat into it.
+        published_at = int(time.time())
+        expires_at = published_at + (expires_at - publish_at)
+        await mark_ad_published(oid, message.message_id, published_at, expires_at)
+        self._push(expires_at, oid, EXPIRE)
+
+        if pinned:
+            try:
+                await self.bot.pin_chat_message(
+                    chat_id=self.channel,
+                    message_id=message.message_id,
+                    disable_notification=True
+                )
+            except TelegramError as e:
+                print("AD PIN ERROR:", oid, e)
+
+        try:
+            await self.bot.send_message(
+                chat_id=uid,
+                text="✅ Reklamangiz kanalga joylandi!"
+            )
+        except TelegramError:
+            pass
+
+    async def _expire(self, order_id):
+        order = await get_scheduled_ad(order_id)
+        if not order or order[4] != "published":
+            return
+
+        oid, uid, package, ad_text, status, publish_at, expires_at, message_id = order
+        _, pinned = AD_DURATIONS.get(package, (0, False))
+
+        if pinned:
+            try:
+                await self.bot.unpin_chat_message(chat_id=self.channel, message_id=message_id)
+            except BadRequest as e:
+                print("AD UNPIN ERROR:", oid, e)
+
+        try:
+            await self.bot.delete_message(chat_id=self.channel, message_id=message_id)
+        except BadRequest as e:
+            # Already deleted by hand, or too old for a bot to delete.
+            print("AD EXPIRE ERROR:", oid, e)
+
+        await mark_ad_expired(oid)
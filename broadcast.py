@@ -0,0 +1,210 @@
+import asyncio
+import time
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+from db import (
+    get_broadcast,
+    get_running_broadcasts,
+    get_broadcast_recipients,
+    save_broadcast_progress,
+    finish_broadcast,
+    RECIPIENT_SENT,
+    RECIPIENT_FAILED,
+    RECIPIENT_BLOCKED
+)
+from ratelimit import PRIORITY_BULK
+
+BROADCAST_CONCURRENCY = 20
+BROADCAST_BATCH = 500
+PROGRESS_FLUSH_SIZE = 200
+REPORT_INTERVAL = 5
+MAX_RETRIES = 3
+RETRY_DELAY = 1
+
+UNDELIVERABLE_ERRORS = (
+    "chat not found",
+    "user is deactivated",
+    "bot was blocked",
+    "bot was kicked",
+    "peer_id_invalid",
+)
+
+_running = {}
+
+
+def running_broadcasts():
+    return len(_running)
+
+
+def is_undeliverable(error):
+    message = str(error).lower()
+    return any(reason in message for reason in UNDELIVERABLE_ERRORS)
+
+
+class BroadcastJob:
+    def __init__(self, bot, broadcast_id, text, admin_chat_id, total, sent=0, failed=0, blocked=0):
+        self.bot = bot
+        self.broadcast_id = broadcast_id
+        self.text = text
+        self.admin_chat_id = admin_chat_id
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self.blocked = blocked
+        self.started_at = time.monotonic()
+        self._done_this_run = 0
+        self._results = []
+        self._flush_lock = asyncio.Lock()
+
+    @property
+    def throughput(self):
+        elapsed = time.monotonic() - self.started_at
+        return self._done_this_run / elapsed if elapsed > 0 else 0.0
+
+    def report_text(self, finished=False):
+        head = "✅ Broadcast tugadi!" if finished else "⏳ Broadcast yuborilmoqda..."
+        left = max(self.total - self.sent - self.failed - self.blocked, 0)
+        return (
+            f"{head}\n\n"
+            f"🆔 Broadcast: {self.broadcast_id}\n"
+            f"✅ Yuborildi: {self.sent}\n"
+            f"❌ Xato: {self.failed}\n"
+            f"🚫 Bloklagan: {self.blocked}\n"
+            f"⏳ Qoldi: {left}\n"
+            f"⚡ Tezlik: {self.throughput:.1f} msg/s"
+        )
+
+    async def _send(self, user_id):
+        for attempt in range(MAX_RETRIES):
+            try:
+                await self.bot.send_message(
+                    chat_id=user_id,
+                    text=self.text,
+                    rate_limit_args=PRIORITY_BULK
+                )
+                return RECIPIENT_SENT
+            except RetryAfter:
+                # the outbound limiter already waited out and retried 429s
+                return RECIPIENT_FAILED
+            except Forbidden:
+                return RECIPIENT_BLOCKED
+            except BadRequest as e:
+                if is_undeliverable(e):
+                    return RECIPIENT_BLOCKED
+                return RECIPIENT_FAILED
+            except TelegramError:
+                await asyncio.sleep(RETRY_DELAY * (attempt + 1))
+        return RECIPIENT_FAILED
+
+    async def _flush(self):
+        async with self._flush_lock:
+            if not self._results:
+                return
+            results, self._results = self._results, []
+            await save_broadcast_progress(self.broadcast_id, results)
+
+    async def _worker(self, queue):
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+
+            status = await self._send(user_id)
+            if status == RECIPIENT_SENT:
+                self.sent += 1
+            elif status == RECIPIENT_BLOCKED:
+                self.blocked += 1
+            else:
+                self.failed += 1
+            self._done_this_run += 1
+
+            self._results.append((user_id, status))
+            if len(self._results) >= PROGRESS_FLUSH_SIZE:
+                await self._flush()
+
+    async def _reporter(self, message):
+        last_text = None
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            text = self.report_text()
+            if text == last_text:
+                continue
+            try:
+                await message.edit_text(text)
+                last_text = text
+            except TelegramError:
+                pass
+
+    async def run(self):
+        message = await self.bot.send_message(chat_id=self.admin_chat_id, text=self.report_text())
+        reporter = asyncio.create_task(self._reporter(message))
+
+        queue = asyncio.Queue(maxsize=BROADCAST_CONCURRENCY * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(BROADCAST_CONCURRENCY)]
+
+        try:
+            after = 0
+            while True:
+                recipients = await get_broadcast_recipients(self.broadcast_id, after, BROADCAST_BATCH)
+                if not recipients:
+                    break
+                for user_id in recipients:
+                    await queue.put(user_id)
+                after = recipients[-1]
+
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            for worker in workers:
+                worker.cancel()
+            await self._flush()
+
+        await finish_broadcast(self.broadcast_id)
+
+        try:
+            await message.edit_text(self.report_text(finished=True))
+        except TelegramError:
+            await self.bot.send_message(chat_id=self.admin_chat_id, text=self.report_text(finished=True))
+
+
+async def _run_job(broadcast_id, bot):
+    try:
+        row = await get_broadcast(broadcast_id)
+        if not row:
+            return
+
+        bid, text, admin_chat_id, total, sent, failed, blocked, status = row
+        if status != "running":
+            return
+
+        job = BroadcastJob(bot, bid, text, admin_chat_id, total, sent, failed, blocked)
+        await job.run()
+    except Exception as e:
+        print("BROADCAST ERROR:", broadcast_id, repr(e))
+    finally:
+        _running.pop(broadcast_id, None)
+
+
+# Plain tasks rather than application.create_task: Application.stop() waits
+# for those, and a broadcast can run for an hour.
+def start_broadcast(application, broadcast_id):
+    if broadcast_id in _running:
+        return
+    _running[broadcast_id] = asyncio.create_task(_run_job(broadcast_id, application.bot))
+
+
+async def stop_broadcasts():
+    # progress is saved by BroadcastJob.run; the broadcast stays 'running'
+    # and resume_broadcasts picks it up on the next start
+    tasks = list(_running.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def resume_broadcasts(application):
+    for broadcast_id in await get_running_broadcasts():
+        start_broadcast(application, broadcast_id)
@@ -0,0 +1,91 @@
+import csv
+import io
+import re
+
+from db import BULK_DONE, BULK_UNCHANGED, BULK_NOT_FOUND
+
+MAX_FILE_SIZE = 2 * 1024 * 1024
+MAX_ROWS = 20_000
+INLINE_ROWS = 20
+
+STATUS_LABELS = {
+    BULK_DONE: "✅ bajarildi",
+    BULK_UNCHANGED: "➖ o‘zgarmadi",
+    BULK_NOT_FOUND: "❓ topilmadi",
+}
+
+_SEPARATORS = re.compile(r"[\s,;]+")
+
+
+async def read_input(message):
+    document = message.document
+    if document is None:
+        return message.text or ""
+
+    if document.file_size and document.file_size > MAX_FILE_SIZE:
+        raise ValueError("file too large")
+
+    file = await document.get_file()
+    data = await file.download_as_bytearray()
+    return bytes(data).decode("utf-8-sig")
+
+
+def parse_ids(text):
+    ids = []
+    invalid = []
+    for token in _SEPARATORS.split(text):
+        if not token:
+            continue
+        try:
+            ids.append(int(token))
+        except ValueError:
+            invalid.append(token)
+    return ids, invalid
+
+
+def parse_point_rows(text, sign=1):
+    rows = []
+    invalid = []
+    for line in text.splitlines():
+        parts = [part for part in _SEPARATORS.split(line) if part]
+        if not parts:
+            continue
+        try:
+            user_id, points = (int(part) for part in parts)
+        except ValueError:
+            invalid.append(line.strip())
+            continue
+        rows.append((user_id, sign * points))
+    return rows, invalid
+
+
+def summary(title, results, invalid):
+    counts = {status: 0 for status in STATUS_LABELS}
+    for row in results:
+        counts[row[-1]] += 1
+
+    lines = [
+        title,
+        "",
+        f"{STATUS_LABELS[BULK_DONE]}: {counts[BULK_DONE]}",
+        f"{STATUS_LABELS[BULK_UNCHANGED]}: {counts[BULK_UNCHANGED]}",
+        f"{STATUS_LABELS[BULK_NOT_FOUND]}: {counts[BULK_NOT_FOUND]}",
+        f"❌ xato qator: {len(invalid)}",
+    ]
+
+    if len(results) + len(invalid) <= INLINE_ROWS:
+        if results or invalid:
+            lines.append("")
+        for row in results:
+            lines.append(" ".join(str(value) for value in row[:-1]) + f" — {STATUS_LABELS[row[-1]]}")
+        for raw in invalid:
+            lines.append(f"{raw} — ❌ xato")
+        return "\n".join(lines), None
+
+    out = io.StringIO()
+    writer = csv.writer(out)
+    for row in results:
+        writer.writerow([*row[:-1], STATUS_LABELS[row[-1]]])
+    for raw in invalid:
+        writer.writerow([raw, "❌ xato"])
+    return "\n".join(lines), out.getvalue().encode("utf-8")
@@ -0,0 +1,104 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at is None or expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+
+        self.misses += 1
+        return default
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return entry[1] if entry is not None else default
+
+    def clear(self):
+        self._data.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class SubscriptionCache:
+    def __init__(self, positive_ttl=600, negative_ttl=30, maxsize=100_000):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.coalesced = 0
+        self._cache = TTLCache(maxsize)
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._cache)
+
+    @property
+    def hits(self):
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        return self._cache.misses
+
+    @property
+    def hit_rate(self):
+        return self._cache.hit_rate
+
+    def invalidate(self, user_id):
+        self._cache.pop(user_id)
+
+    async def get(self, user_id, fetch):
+        cached = self._cache.get(user_id, _MISSING)
+        if cached is not _MISSING:
+            return cached
+
+        task = self._inflight.get(user_id)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(self._load(user_id, fetch))
+        self._inflight[user_id] = task
+        return await asyncio.shield(task)
+
+    async def _load(self, user_id, fetch):
+        try:
+            result = await fetch()
+        finally:
+            self._inflight.pop(user_id, None)
+
+        if result is None:
+            return False
+
+        self._cache.set(user_id, result, self.positive_ttl if result else self.negative_ttl)
+        return result
@@ -1,231 +1,933 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
 import aiosqlite
 
+from cache import TTLCache
+from leaderboard import Leaderboard
+from metrics import DB_SECONDS, DB_WAIT_SECONDS
+
 DB_NAME = "database.db"
 
+READ_POOL_SIZE = 4
+STATEMENT_CACHE_SIZE = 256
 
-async def init_db():
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            points INTEGER DEFAULT 0,
-            invited_by INTEGER DEFAULT NULL,
-            is_banned INTEGER DEFAULT 0
-        )
-        """)
+WRITE_BATCH_SIZE = 200
+WRITE_BATCH_DELAY = 0.005
 
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS settings (
-            id INTEGER PRIMARY KEY,
-            giveaway_active INTEGER DEFAULT 0,
-            giveaway_prize TEXT DEFAULT '🎁 Sovg‘a yo‘q'
-        )
-        """)
+USER_CACHE_SIZE = 50_000
 
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA busy_timeout=5000",
+)
+
+RECIPIENT_SENT = 1
+RECIPIENT_FAILED = 2
+RECIPIENT_BLOCKED = 3
+
+BULK_DONE = 1
+BULK_UNCHANGED = 2
+BULK_NOT_FOUND = 3
+BULK_CHUNK = 500
+
+EXPORT_BATCH = 1000
+EXPORT_COLUMNS = {
+    "users": ("user_id", "username", "first_name", "points", "invited_by", "is_banned", "blocked_at"),
+    "ads_orders": (
+        "id", "user_id", "package", "price", "ad_text", "receipt_file_id",
+        "status", "publish_at", "expires_at", "message_id"
+    ),
+}
+
+DEFAULT_PRIZE = "🎁 Sovg‘a yo‘q"
+
+_writer = None
+_readers = None
+_settings = {"giveaway_active": 0, "giveaway_prize": DEFAULT_PRIZE}
+
+leaderboard = Leaderboard()
+
+# user_id -> (is_banned, points, first_name); None means "no such user"
+user_cache = TTLCache(USER_CACHE_SIZE)
+_user_epoch = 0
+_MISSING = object()
+_write_lock = asyncio.Lock()
+
+
+async def _connect():
+    db = await aiosqlite.connect(DB_NAME, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        await db.execute(pragma)
+    return db
+
+
+async def open_db():
+    global _writer, _readers
+
+    if _writer is not None:
+        return
+
+    _writer = await _connect()
+    _readers = asyncio.Queue()
+    for _ in range(READ_POOL_SIZE):
+        _readers.put_nowait(await _connect())
+
+
+async def close_db():
+    global _writer, _readers
+
+    if _writer is None:
+        return
+
+    await flush_writes()
+
+    while not _readers.empty():
+        await _readers.get_nowait().close()
+    await _writer.execute("PRAGMA optimize")
+    await _writer.close()
+
+    _writer = None
+    _readers = None
+
+
+@asynccontextmanager
+async def _read(function):
+    start = time.perf_counter()
+    db = await _readers.get()
+    acquired = time.perf_counter()
+    DB_WAIT_SECONDS.observe(acquired - start, "read")
+    try:
+        yield db
+    finally:
+        _readers.put_nowait(db)
+        DB_SECONDS.observe(time.perf_counter() - acquired, "read", function)
+
+
+@asynccontextmanager
+async def _write(function):
+    start = time.perf_counter()
+    async with _write_lock:
+        acquired = time.perf_counter()
+        DB_WAIT_SECONDS.observe(acquired - start, "write")
+        try:
+            yield _writer
+        except BaseException:
+            await _writer.rollback()
+            raise
+        await _writer.commit()
+        DB_SECONDS.observe(time.perf_counter() - acquired, "write", function)
+
+
+async def _add_column(db, table, column, definition):
+    async with db.execute(f"PRAGMA table_info({table})") as cur:
+        columns = [row[1] for row in await cur.fetchall()]
+
+    if column not in columns:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+async def _migrate_base(db):
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        points INTEGER DEFAULT 0,
+        invited_by INTEGER DEFAULT NULL,
+        is_banned INTEGER DEFAULT 0
+    )
+    """)
+
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS settings (
+        id INTEGER PRIMARY KEY,
+        giveaway_active INTEGER DEFAULT 0,
+        giveaway_prize TEXT DEFAULT '🎁 Sovg‘a yo‘q'
+    )
+    """)
+
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS ads_orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        package TEXT,
+        price INTEGER,
+        ad_text TEXT,
+        receipt_file_id TEXT DEFAULT NULL,
+        status TEXT DEFAULT 'pending'
+    )
+    """)
+
+    await db.execute("""
+    INSERT OR IGNORE INTO settings (id, giveaway_active, giveaway_prize)
+    VALUES (1, 0, '🎁 Sovg‘a yo‘q')
+    """)
+
+
+async def _migrate_broadcasts(db):
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT,
+        admin_chat_id INTEGER,
+        total INTEGER DEFAULT 0,
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'running',
+        created_at INTEGER DEFAULT (strftime('%s', 'now'))
+    )
+    """)
+
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS broadcast_recipients (
+        broadcast_id INTEGER,
+        user_id INTEGER,
+        status INTEGER DEFAULT 0,
+        PRIMARY KEY (broadcast_id, user_id)
+    ) WITHOUT ROWID
+    """)
+
+
+async def _migrate_blocked_users(db):
+    await _add_column(db, "users", "blocked_at", "INTEGER DEFAULT NULL")
+    await _add_column(db, "broadcasts", "blocked", "INTEGER DEFAULT 0")
+
+    # Left to itself the planner seeks idx_users_top on is_banned and checks
+    # blocked_at row by row, so the deliverable queries name this index.
+    await db.execute("""
+    CREATE INDEX IF NOT EXISTS idx_users_deliverable
+    ON users (user_id) WHERE is_banned=0 AND blocked_at IS NULL
+    """)
+
+
+async def _migrate_counters(db):
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER DEFAULT 0
+    ) WITHOUT ROWID
+    """)
+
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_users_insert AFTER INSERT ON users
+    BEGIN
+        UPDATE counters SET value = value + 1 WHERE name='users';
+        UPDATE counters SET value = value + 1 WHERE name='banned' AND NEW.is_banned=1;
+    END
+    """)
+
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_users_delete AFTER DELETE ON users
+    BEGIN
+        UPDATE counters SET value = value - 1 WHERE name='users';
+        UPDATE counters SET value = value - 1 WHERE name='banned' AND OLD.is_banned=1;
+    END
+    """)
+
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_users_ban AFTER UPDATE OF is_banned ON users
+    WHEN (OLD.is_banned=1) != (NEW.is_banned=1)
+    BEGIN
+        UPDATE counters SET value = value + (CASE WHEN NEW.is_banned=1 THEN 1 ELSE -1 END)
+        WHERE name='banned';
+    END
+    """)
+
+    await db.execute("""
+    INSERT OR IGNORE INTO counters (name, value)
+    SELECT 'users', COUNT(*) FROM users
+    """)
+
+    await db.execute("""
+    INSERT OR IGNORE INTO counters (name, value)
+    SELECT 'banned', COUNT(*) FROM users WHERE is_banned=1
+    """)
+
+
+async def _migrate_indexes(db):
+    await db.execute("""
+    CREATE INDEX IF NOT EXISTS idx_users_top
+    ON users (is_banned, points DESC, first_name)
+    """)
+
+    await db.execute("""
+    CREATE INDEX IF NOT EXISTS idx_users_page
+    ON users (points DESC, user_id DESC, first_name)
+    """)
+
+    await db.execute("""
+    CREATE INDEX IF NOT EXISTS idx_ads_orders_status
+    ON ads_orders (status, id)
+    """)
+
+    await db.execute("""
+    CREATE INDEX IF NOT EXISTS idx_ads_orders_user
+    ON ads_orders (user_id, status, id)
+    """)
+
+
+async def _migrate_bot_state(db):
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS bot_state (
+        kind TEXT,
+        key TEXT,
+        data BLOB,
+        PRIMARY KEY (kind, key)
+    ) WITHOUT ROWID
+    """)
+
+
+async def _migrate_ad_schedule(db):
+    await _add_column(db, "ads_orders", "publish_at", "INTEGER DEFAULT NULL")
+    await _add_column(db, "ads_orders", "expires_at", "INTEGER DEFAULT NULL")
+    await _add_column(db, "ads_orders", "message_id", "INTEGER DEFAULT NULL")
+
+
+MIGRATIONS = (
+    (1, _migrate_base),
+    (2, _migrate_broadcasts),
+    (3, _migrate_blocked_users),
+    (4, _migrate_counters),
+    (5, _migrate_indexes),
+    (6, _migrate_bot_state),
+    (7, _migrate_ad_schedule),
+)
+
+
+async def get_schema_version():
+    async with _read("get_schema_version") as db:
+        async with db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version") as cur:
+            row = await cur.fetchone()
+        return row[0]
+
+
+async def migrate():
+    async with _write("migrate") as db:
         await db.execute("""
-        CREATE TABLE IF NOT EXISTS ads_orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            package TEXT,
-            price INTEGER,
-            ad_text TEXT,
-            receipt_file_id TEXT DEFAULT NULL,
-            status TEXT DEFAULT 'pending'
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            applied_at INTEGER DEFAULT (strftime('%s', 'now'))
         )
         """)
 
-        await db.execute("""
-        INSERT OR IGNORE INTO settings (id, giveaway_active, giveaway_prize)
-        VALUES (1, 0, '🎁 Sovg‘a yo‘q')
-        """)
+    current = await get_schema_version()
+    applied = False
 
-        await db.commit()
+    for version, migration in MIGRATIONS:
+        if version <= current:
+            continue
+
+        async with _write("migrate") as db:
+            await db.execute("BEGIN")
+            await migration(db)
+            await db.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+        applied = True
+
+    if applied:
+        async with _write("migrate") as db:
+            await db.execute("ANALYZE")
 
-async def add_user(user_id, username, first_name, invited_by=None):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute("SELECT user_id FROM users WHERE user_id=?", (user_id,))
-        exists = await cur.fetchone()
 
-        if exists:
+async def init_db():
+    await open_db()
+    await migrate()
+    await _load_settings()
+    await _load_leaderboard()
+
+
+async def _load_leaderboard():
+    async with _read("_load_leaderboard") as db:
+        async with db.execute("SELECT user_id, first_name, points FROM users WHERE is_banned=0") as cur:
+            leaderboard.load(await cur.fetchall())
+
+
+async def _load_settings():
+    async with _read("_load_settings") as db:
+        async with db.execute("SELECT giveaway_active, giveaway_prize FROM settings WHERE id=1") as cur:
+            row = await cur.fetchone()
+
+    if row:
+        _settings["giveaway_active"], _settings["giveaway_prize"] = row
+
+class _WriteBatch:
+    def __init__(self):
+        self._ops = []
+        self._timer = None
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._ops)
+
+    def submit(self, kind, args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._ops.append((kind, args, future))
+
+        if len(self._ops) >= WRITE_BATCH_SIZE:
+            self._spawn_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(WRITE_BATCH_DELAY, self._spawn_flush)
+        return future
+
+    def _spawn_flush(self):
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        ops, self._ops = self._ops, []
+        if not ops:
             return
 
-        await db.execute(
-            "INSERT INTO users (user_id, username, first_name, invited_by) VALUES (?, ?, ?, ?)",
-            (user_id, username, first_name, invited_by)
-        )
+        try:
+            async with _write("flush") as db:
+                results, new_users, deltas = await self._apply(db, ops)
+        except Exception as e:
+            for _, _, future in ops:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for user_id, first_name in new_users:
+            leaderboard.set(user_id, 0, first_name)
+            _cache_user(user_id, (0, 0, first_name))
+        for user_id, delta in deltas.items():
+            leaderboard.add(user_id, delta)
+            _update_cached_user(user_id, points=delta)
+
+        for (_, _, future), result in zip(ops, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _apply(self, db, ops):
+        results = []
+        new_users = []
+        returning = []
+        deltas = {}
+
+        for kind, args, _ in ops:
+            if kind == "add_user":
+                user_id, username, first_name, invited_by = args
+                cur = await db.execute(
+                    "INSERT OR IGNORE INTO users (user_id, username, first_name, invited_by) "
+                    "VALUES (?, ?, ?, ?)",
+                    (user_id, username, first_name, invited_by)
+                )
+                inserted = cur.rowcount > 0
+
+                if inserted:
+                    new_users.append((user_id, first_name))
+                    if invited_by and invited_by != user_id:
+                        deltas[invited_by] = deltas.get(invited_by, 0) + 1
+                else:
+                    returning.append((user_id,))
+                results.append(inserted)
+
+            elif kind == "points":
+                user_id, amount = args
+                deltas[user_id] = deltas.get(user_id, 0) + amount
+                results.append(None)
+
+        if returning:
+            await db.executemany(
+                "UPDATE users SET blocked_at=NULL WHERE user_id=? AND blocked_at IS NOT NULL",
+                returning
+            )
+
+        if deltas:
+            await db.executemany(
+                "UPDATE users SET points = points + ? WHERE user_id=?",
+                [(delta, user_id) for user_id, delta in deltas.items() if delta]
+            )
+
+        return results, new_users, deltas
+
+
+_batch = _WriteBatch()
+
 
-        if invited_by and invited_by != user_id:
-            await db.execute("UPDATE users SET points = points + 1 WHERE user_id=?", (invited_by,))
+def pending_writes():
+    return len(_batch)
 
-        await db.commit()
+
+async def flush_writes():
+    await _batch.flush()
+
+
+async def add_user(user_id, username, first_name, invited_by=None):
+    return await _batch.submit("add_user", (user_id, username, first_name, invited_by))
+
+
+def _cache_user(user_id, record):
+    global _user_epoch
+    _user_epoch += 1
+    user_cache.set(user_id, record)
+
+
+def _update_cached_user(user_id, banned=None, points=0):
+    global _user_epoch
+    _user_epoch += 1
+
+    record = user_cache.get(user_id, _MISSING)
+    if record is _MISSING:
+        return
+    if record is None:
+        user_cache.pop(user_id)
+        return
+
+    old_banned, old_points, first_name = record
+    user_cache.set(user_id, (old_banned if banned is None else banned, old_points + points, first_name))
+
+
+async def _get_user_record(user_id):
+    record = user_cache.get(user_id, _MISSING)
+    if record is not _MISSING:
+        return record
+
+    epoch = _user_epoch
+    async with _read("_get_user_record") as db:
+        async with db.execute(
+            "SELECT is_banned, points, first_name FROM users WHERE user_id=?", (user_id,)
+        ) as cur:
+            record = await cur.fetchone()
+
+    record = tuple(record) if record else None
+    if epoch == _user_epoch:
+        user_cache.set(user_id, record)
+    return record
 
 
 async def get_user_points(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute("SELECT points FROM users WHERE user_id=?", (user_id,))
-        row = await cur.fetchone()
-        return row[0] if row else 0
+    record = await _get_user_record(user_id)
+    return record[1] if record else 0
 
 
 async def add_points(user_id, amount):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE users SET points = points + ? WHERE user_id=?", (amount, user_id))
-        await db.commit()
+    await _batch.submit("points", (user_id, amount))
 
 
 async def remove_points(user_id, amount):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE users SET points = points - ? WHERE user_id=?", (amount, user_id))
-        await db.commit()
+    await _batch.submit("points", (user_id, -amount))
 
 
 async def is_banned(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute("SELECT is_banned FROM users WHERE user_id=?", (user_id,))
-        row = await cur.fetchone()
-        return row and row[0] == 1
+    record = await _get_user_record(user_id)
+    return bool(record) and record[0] == 1
+
+
+async def _fetch_users(db, user_ids, columns):
+    found = {}
+    for i in range(0, len(user_ids), BULK_CHUNK):
+        chunk = user_ids[i:i + BULK_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        async with db.execute(
+            f"SELECT user_id, {columns} FROM users WHERE user_id IN ({marks})", chunk
+        ) as cur:
+            for row in await cur.fetchall():
+                found[row[0]] = tuple(row[1:])
+    return found
+
+
+async def set_banned_bulk(user_ids, banned):
+    user_ids = list(dict.fromkeys(user_ids))
+    banned = 1 if banned else 0
+
+    async with _write("set_banned_bulk") as db:
+        found = await _fetch_users(db, user_ids, "is_banned, points, first_name")
+        changed = [
+            user_id for user_id, (is_banned, _, _) in found.items()
+            if (is_banned == 1) != (banned == 1)
+        ]
+        await db.executemany(
+            "UPDATE users SET is_banned=? WHERE user_id=?",
+            [(banned, user_id) for user_id in changed]
+        )
+
+    for user_id in changed:
+        _, points, first_name = found[user_id]
+        if banned:
+            leaderboard.remove(user_id)
+        else:
+            leaderboard.set(user_id, points, first_name)
+        _update_cached_user(user_id, banned=banned)
+
+    changed = set(changed)
+    return [
+        (user_id, BULK_NOT_FOUND if user_id not in found else BULK_DONE if user_id in changed else BULK_UNCHANGED)
+        for user_id in user_ids
+    ]
+
+
+async def adjust_points_bulk(rows):
+    deltas = {}
+    for user_id, delta in rows:
+        deltas[user_id] = deltas.get(user_id, 0) + delta
+
+    async with _write("adjust_points_bulk") as db:
+        found = await _fetch_users(db, list(deltas), "is_banned")
+        await db.executemany(
+            "UPDATE users SET points = points + ? WHERE user_id=?",
+            [(delta, user_id) for user_id, delta in deltas.items() if delta and user_id in found]
+        )
+
+    for user_id, delta in deltas.items():
+        if delta and user_id in found:
+            leaderboard.add(user_id, delta)
+            _update_cached_user(user_id, points=delta)
+
+    return [
+        (user_id, delta, BULK_DONE if user_id in found else BULK_NOT_FOUND)
+        for user_id, delta in rows
+    ]
 
 
 async def ban_user(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE users SET is_banned=1 WHERE user_id=?", (user_id,))
-        await db.commit()
+    await set_banned_bulk([user_id], 1)
 
 
 async def unban_user(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE users SET is_banned=0 WHERE user_id=?", (user_id,))
-        await db.commit()
+    await set_banned_bulk([user_id], 0)
 
 
 async def get_user_info(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute(
+    async with _read("get_user_info") as db:
+        async with db.execute(
             "SELECT user_id, username, first_name, points, is_banned FROM users WHERE user_id=?",
             (user_id,)
-        )
-        return await cur.fetchone()
+        ) as cur:
+            return await cur.fetchone()
 
 
 async def total_users():
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute("SELECT COUNT(*) FROM users")
-        row = await cur.fetchone()
+    async with _read("total_users") as db:
+        async with db.execute("SELECT value FROM counters WHERE name='users'") as cur:
+            row = await cur.fetchone()
         return row[0] if row else 0
 
 
 async def total_banned():
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute("SELECT COUNT(*) FROM users WHERE is_banned=1")
-        row = await cur.fetchone()
+    async with _read("total_banned") as db:
+        async with db.execute("SELECT value FROM counters WHERE name='banned'") as cur:
+            row = await cur.fetchone()
         return row[0] if row else 0
 
 
-async def top_users(limit=10):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute(
-            "SELECT first_name, points FROM users WHERE is_banned=0 ORDER BY points DESC LIMIT ?",
-            (limit,)
+async def rebuild_counters():
+    async with _write("rebuild_counters") as db:
+        await db.execute(
+            "INSERT OR REPLACE INTO counters (name, value) SELECT 'users', COUNT(*) FROM users"
+        )
+        await db.execute(
+            "INSERT OR REPLACE INTO counters (name, value) SELECT 'banned', COUNT(*) FROM users WHERE is_banned=1"
         )
-        return await cur.fetchall()
+
+    return await total_users(), await total_banned()
+
+
+async def top_users(limit=10):
+    return [(name, points) for _, name, points in leaderboard.top(limit)]
+
+
+async def get_user_rank(user_id):
+    return leaderboard.rank(user_id)
 
 
 async def get_all_users():
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute("SELECT user_id FROM users WHERE is_banned=0")
-        rows = await cur.fetchall()
+    async with _read("get_all_users") as db:
+        async with db.execute(
+            "SELECT user_id FROM users INDEXED BY idx_users_deliverable "
+            "WHERE is_banned=0 AND blocked_at IS NULL"
+        ) as cur:
+            rows = await cur.fetchall()
         return [r[0] for r in rows]
 
 
-async def get_users_page(page=1, per_page=10):
-    offset = (page - 1) * per_page
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute(
-            "SELECT user_id, first_name, points FROM users ORDER BY points DESC LIMIT ? OFFSET ?",
-            (per_page, offset)
+async def get_users_page(cursor=None, per_page=10, backward=False):
+    if cursor is None:
+        sql = (
+            "SELECT user_id, first_name, points FROM users "
+            "ORDER BY points DESC, user_id DESC LIMIT ?"
         )
-        return await cur.fetchall()
+        params = (per_page + 1,)
+    else:
+        # A row value (points, user_id) < (?, ?) only seeks on points, so the
+        # cursor is split into the tie on points and the points strictly past it.
+        op, order = (">", "ASC") if backward else ("<", "DESC")
+        sql = (
+            "SELECT * FROM ("
+            "SELECT user_id, first_name, points FROM users "
+            f"WHERE points = ? AND user_id {op} ? ORDER BY user_id {order} LIMIT ?"
+            ") UNION ALL SELECT * FROM ("
+            "SELECT user_id, first_name, points FROM users "
+            f"WHERE points {op} ? ORDER BY points {order}, user_id {order} LIMIT ?"
+            f") ORDER BY points {order}, user_id {order} LIMIT ?"
+        )
+        params = (cursor[0], cursor[1], per_page + 1, cursor[0], per_page + 1, per_page + 1)
+
+    async with _read("get_users_page") as db:
+        async with db.execute(sql, params) as cur:
+            rows = await cur.fetchall()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backward:
+        rows.reverse()
+    return rows, has_more
 
 
 async def get_top_user():
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute(
-            "SELECT user_id, first_name, points FROM users WHERE is_banned=0 ORDER BY points DESC LIMIT 1"
-        )
-        return await cur.fetchone()
+    top = leaderboard.top(1)
+    return top[0] if top else None
 
 async def set_giveaway(status: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _write("set_giveaway") as db:
         await db.execute("UPDATE settings SET giveaway_active=? WHERE id=1", (status,))
-        await db.commit()
+    _settings["giveaway_active"] = status
 
 
 async def get_giveaway():
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute("SELECT giveaway_active FROM settings WHERE id=1")
-        row = await cur.fetchone()
-        return row[0] if row else 0
+    return _settings["giveaway_active"]
 
 
 async def set_giveaway_prize(prize):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _write("set_giveaway_prize") as db:
         await db.execute("UPDATE settings SET giveaway_prize=? WHERE id=1", (prize,))
-        await db.commit()
+    _settings["giveaway_prize"] = prize
 
 
 async def get_giveaway_prize():
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute("SELECT giveaway_prize FROM settings WHERE id=1")
-        row = await cur.fetchone()
-        return row[0] if row else "🎁 Sovg‘a yo‘q"
+    return _settings["giveaway_prize"] or DEFAULT_PRIZE
+
+
+async def get_menu_snapshot(user_id):
+    points = await get_user_points(user_id)
+    users_count = await total_users()
+    return points, users_count, _settings["giveaway_active"], await get_giveaway_prize()
+
+
+async def get_admin_snapshot():
+    async with _read("get_admin_snapshot") as db:
+        async with db.execute(
+            "SELECT (SELECT value FROM counters WHERE name='users'), "
+            "(SELECT value FROM counters WHERE name='banned')"
+        ) as cur:
+            users_count, banned_count = await cur.fetchone()
+
+    return users_count or 0, banned_count or 0, _settings["giveaway_active"], await get_giveaway_prize()
 
 async def create_ads_order(user_id, package, price, ad_text):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _write("create_ads_order") as db:
         await db.execute(
             "INSERT INTO ads_orders (user_id, package, price, ad_text, status) VALUES (?, ?, ?, ?, 'pending')",
             (user_id, package, price, ad_text)
         )
-        await db.commit()
 
 
 async def get_last_pending_order(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute(
+    async with _read("get_last_pending_order") as db:
+        async with db.execute(
             "SELECT id FROM ads_orders WHERE user_id=? AND status='pending' ORDER BY id DESC LIMIT 1",
             (user_id,)
-        )
-        return await cur.fetchone()
+        ) as cur:
+            return await cur.fetchone()
 
 
 async def attach_receipt(order_id, receipt_file_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _write("attach_receipt") as db:
         await db.execute(
             "UPDATE ads_orders SET receipt_file_id=?, status='waiting_admin' WHERE id=?",
             (receipt_file_id, order_id)
         )
-        await db.commit()
 
 
-async def get_waiting_orders():
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute(
-            "SELECT id, user_id, package, price, ad_text, receipt_file_id FROM ads_orders WHERE status='waiting_admin' ORDER BY id DESC"
-        )
-        return await cur.fetchall()
+async def get_waiting_order_ids(after_id=0, limit=5):
+    async with _read("get_waiting_order_ids") as db:
+        async with db.execute(
+            "SELECT id FROM ads_orders WHERE status='waiting_admin' AND id>? ORDER BY id LIMIT ?",
+            (after_id, limit + 1)
+        ) as cur:
+            rows = await cur.fetchall()
+
+    ids = [r[0] for r in rows]
+    return ids[:limit], len(ids) > limit
 
 
 async def set_ads_status(order_id, status):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _write("set_ads_status") as db:
         await db.execute("UPDATE ads_orders SET status=? WHERE id=?", (status, order_id))
-        await db.commit()
 
 
 async def get_ads_order(order_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cur = await db.execute(
+    async with _read("get_ads_order") as db:
+        async with db.execute(
             "SELECT id, user_id, package, price, ad_text, receipt_file_id, status FROM ads_orders WHERE id=?",
             (order_id,)
+        ) as cur:
+            return await cur.fetchone()
+
+
+async def schedule_ads_order(order_id, publish_at, expires_at):
+    async with _write("schedule_ads_order") as db:
+        cur = await db.execute(
+            "UPDATE ads_orders SET status='scheduled', publish_at=?, expires_at=? "
+            "WHERE id=? AND status='waiting_admin'",
+            (publish_at, expires_at, order_id)
+        )
+        return cur.rowcount == 1
+
+
+async def get_scheduled_ads():
+    async with _read("get_scheduled_ads") as db:
+        async with db.execute(
+            "SELECT id, status, publish_at, expires_at FROM ads_orders "
+            "WHERE status IN ('scheduled', 'published')"
+        ) as cur:
+            return await cur.fetchall()
+
+
+async def get_scheduled_ad(order_id):
+    async with _read("get_scheduled_ad") as db:
+        async with db.execute(
+            "SELECT id, user_id, package, ad_text, status, publish_at, expires_at, message_id "
+            "FROM ads_orders WHERE id=?",
+            (order_id,)
+        ) as cur:
+            return await cur.fetchone()
+
+
+async def mark_ad_published(order_id, message_id, published_at, expires_at):
+    async with _write("mark_ad_published") as db:
+        await db.execute(
+            "UPDATE ads_orders SET status='published', message_id=?, publish_at=?, expires_at=? "
+            "WHERE id=? AND status='scheduled'",
+            (message_id, published_at, expires_at, order_id)
+        )
+
+
+async def mark_ad_failed(order_id):
+    async with _write("mark_ad_failed") as db:
+        await db.execute(
+            "UPDATE ads_orders SET status='failed' WHERE id=? AND status='scheduled'",
+            (order_id,)
+        )
+
+
+async def mark_ad_expired(order_id):
+    async with _write("mark_ad_expired") as db:
+        await db.execute(
+            "UPDATE ads_orders SET status='expired' WHERE id=? AND status='published'",
+            (order_id,)
+        )
+
+
+async def create_broadcast(text, admin_chat_id):
+    async with _write("create_broadcast") as db:
+        cur = await db.execute(
+            "INSERT INTO broadcasts (text, admin_chat_id) VALUES (?, ?)",
+            (text, admin_chat_id)
+        )
+        broadcast_id = cur.lastrowid
+
+        cur = await db.execute(
+            "INSERT INTO broadcast_recipients (broadcast_id, user_id) "
+            "SELECT ?, user_id FROM users INDEXED BY idx_users_deliverable "
+            "WHERE is_banned=0 AND blocked_at IS NULL",
+            (broadcast_id,)
         )
-        return await cur.fetchone()
+        total = cur.rowcount
+
+        await db.execute("UPDATE broadcasts SET total=? WHERE id=?", (total, broadcast_id))
+        return broadcast_id, total
+
+
+async def get_broadcast(broadcast_id):
+    async with _read("get_broadcast") as db:
+        async with db.execute(
+            "SELECT id, text, admin_chat_id, total, sent, failed, blocked, status FROM broadcasts WHERE id=?",
+            (broadcast_id,)
+        ) as cur:
+            return await cur.fetchone()
+
+
+async def get_running_broadcasts():
+    async with _read("get_running_broadcasts") as db:
+        async with db.execute("SELECT id FROM broadcasts WHERE status='running' ORDER BY id") as cur:
+            rows = await cur.fetchall()
+        return [r[0] for r in rows]
+
+
+async def get_broadcast_recipients(broadcast_id, after_user_id=0, limit=500):
+    async with _read("get_broadcast_recipients") as db:
+        async with db.execute(
+            "SELECT user_id FROM broadcast_recipients "
+            "WHERE broadcast_id=? AND status=0 AND user_id>? ORDER BY user_id LIMIT ?",
+            (broadcast_id, after_user_id, limit)
+        ) as cur:
+            rows = await cur.fetchall()
+        return [r[0] for r in rows]
+
+
+async def save_broadcast_progress(broadcast_id, results):
+    sent = sum(1 for _, status in results if status == RECIPIENT_SENT)
+    blocked = [user_id for user_id, status in results if status == RECIPIENT_BLOCKED]
+    failed = len(results) - sent - len(blocked)
+
+    async with _write("save_broadcast_progress") as db:
+        await db.executemany(
+            "UPDATE broadcast_recipients SET status=? WHERE broadcast_id=? AND user_id=?",
+            [(status, broadcast_id, user_id) for user_id, status in results]
+        )
+        await db.execute(
+            "UPDATE broadcasts SET sent = sent + ?, failed = failed + ?, blocked = blocked + ? WHERE id=?",
+            (sent, failed, len(blocked), broadcast_id)
+        )
+
+        if blocked:
+            await db.executemany(
+                "UPDATE users SET blocked_at=strftime('%s', 'now') WHERE user_id=?",
+                [(user_id,) for user_id in blocked]
+            )
+
+
+async def finish_broadcast(broadcast_id):
+    async with _write("finish_broadcast") as db:
+        await db.execute("UPDATE broadcasts SET status='done' WHERE id=?", (broadcast_id,))
+        await db.execute("DELETE FROM broadcast_recipients WHERE broadcast_id=?", (broadcast_id,))
+
+
+async def iter_export_rows(table, batch_size=EXPORT_BATCH):
+    columns = EXPORT_COLUMNS[table]
+    async with _read("iter_export_rows") as db:
+        async with db.execute(f"SELECT {', '.join(columns)} FROM {table}") as cur:
+            while True:
+                rows = await cur.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield rows
+
+
+async def load_bot_state(kind):
+    async with _read("load_bot_state") as db:
+        async with db.execute("SELECT key, data FROM bot_state WHERE kind=?", (kind,)) as cur:
+            return await cur.fetchall()
+
+
+async def save_bot_state(rows, deletes=()):
+    async with _write("save_bot_state") as db:
+        if rows:
+            await db.executemany(
+                "INSERT OR REPLACE INTO bot_state (kind, key, data) VALUES (?, ?, ?)",
+                rows
+            )
+        if deletes:
+            await db.executemany("DELETE FROM bot_state WHERE kind=? AND key=?", deletes)
@@ -0,0 +1,84 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+
+from db import EXPORT_COLUMNS, iter_export_rows
+
+FORMATS = ("csv", "jsonl")
+TABLE_ALIASES = {
+    "users": "users",
+    "orders": "ads_orders",
+    "ads_orders": "ads_orders",
+}
+
+# Telegram rejects documents above 50 MB
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+
+def _encode(rows, columns, fmt):
+    if fmt == "csv":
+        out = io.StringIO()
+        csv.writer(out).writerows(rows)
+        return out.getvalue().encode("utf-8")
+
+    return "".join(
+        json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n"
+        for row in rows
+    ).encode("utf-8")
+
+
+def _write(file, rows, columns, fmt):
+    file.write(_encode(rows, columns, fmt))
+
+
+async def export_table(table, fmt, path):
+    columns = EXPORT_COLUMNS[table]
+    count = 0
+
+    # Compression and disk writes run in a thread; only one batch of rows
+    # is held in memory at a time.
+    file = await asyncio.to_thread(gzip.open, path, "wb")
+    try:
+        if fmt == "csv":
+            await asyncio.to_thread(_write, file, [columns], columns, fmt)
+
+        async for rows in iter_export_rows(table):
+            await asyncio.to_thread(_write, file, rows, columns, fmt)
+            count += len(rows)
+    finally:
+        await asyncio.to_thread(file.close)
+
+    return count
+
+
+async def send_export(bot, chat_id, table, fmt):
+    filename = f"{table}_{time.strftime('%Y%m%d_%H%M%S')}.{fmt}.gz"
+    fd, path = tempfile.mkstemp(suffix=".gz")
+    os.close(fd)
+
+    try:
+        count = await export_table(table, fmt, path)
+        size = os.path.getsize(path)
+        if size > MAX_DOCUMENT_SIZE:
+            await bot.send_message(
+                chat_id=chat_id,
+                text=f"❌ Fayl juda katta ({size // (1024 * 1024)} MB). Telegram limiti 50 MB."
+            )
+            return
+
+        with open(path, "rb") as document:
+            await bot.send_document(
+                chat_id=chat_id,
+                document=document,
+                filename=filename,
+                caption=f"📤 {table}: {count} ta qator",
+                read_timeout=120,
+                write_timeout=120
+            )
+    finally:
+        os.remove(path)
@@ -0,0 +1,52 @@
+import bisect
+
+
+class Leaderboard:
+    def __init__(self):
+        self._keys = []
+        self._points = {}
+        self._names = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, user_id):
+        return user_id in self._points
+
+    def load(self, rows):
+        self._points = {user_id: points for user_id, _, points in rows}
+        self._names = {user_id: name for user_id, name, _ in rows}
+        self._keys = sorted((-points, user_id) for user_id, points in self._points.items())
+
+    def set(self, user_id, points, name=None):
+        self.remove(user_id)
+        self._points[user_id] = points
+        self._names[user_id] = name
+        bisect.insort(self._keys, (-points, user_id))
+
+    def add(self, user_id, delta):
+        points = self._points.get(user_id)
+        if points is None:
+            return
+        self.set(user_id, points + delta, self._names[user_id])
+
+    def remove(self, user_id):
+        points = self._points.pop(user_id, None)
+        if points is None:
+            return
+        self._names.pop(user_id, None)
+
+        i = bisect.bisect_left(self._keys, (-points, user_id))
+        del self._keys[i]
+
+    def top(self, limit=10):
+        return [
+            (user_id, self._names[user_id], -neg_points)
+            for neg_points, user_id in self._keys[:limit]
+        ]
+
+    def rank(self, user_id):
+        points = self._points.get(user_id)
+        if points is None:
+            return None
+        return bisect.bisect_left(self._keys, (-points, user_id)) + 1
@@ -16,6 +16,7 @@ from telegram.ext import (
 
 from db import (
     init_db,
+    close_db,
     add_user,
     get_user_points,
     top_users,
@@ -23,24 +24,38 @@ from db import (
     is_banned,
     set_giveaway,
     get_giveaway,
-    get_all_users,
     get_users_page,
-    ban_user,
-    unban_user,
-    add_points,
-    remove_points,
+    set_banned_bulk,
+    adjust_points_bulk,
     get_user_info,
-    total_banned,
     create_ads_order,
     get_last_pending_order,
     attach_receipt,
-    get_waiting_orders,
+    get_waiting_order_ids,
     set_ads_status,
     get_ads_order,
     set_giveaway_prize,
     get_giveaway_prize,
-    get_top_user
+    get_top_user,
+    create_broadcast,
+    get_menu_snapshot,
+    get_admin_snapshot,
+    rebuild_counters,
+    get_user_rank,
+    pending_writes,
+    user_cache,
+    leaderboard
 )
+from ads import AdScheduler
+from broadcast import start_broadcast, stop_broadcasts, resume_broadcasts, running_broadcasts
+from bulk import MAX_ROWS, read_input, parse_ids, parse_point_rows, summary
+from export import FORMATS, TABLE_ALIASES, send_export
+from cache import SubscriptionCache
+from persistence import SQLitePersistence
+from processor import UserOrderedUpdateProcessor
+from webhook import WebhookServer
+import metrics
+from ratelimit import PRIORITY_BULK, OutboundLimiter, RateLimiter, Rule
 
 load_dotenv()
 
@@ -51,30 +66,46 @@ CHANNEL_USERNAME = os.getenv("CHANNEL_USERNAME")
 PAYMENT_CARD = os.getenv("PAYMENT_CARD")
 PAYMENT_OWNER = os.getenv("PAYMENT_OWNER")
 
-sub_cache = {}
-flood_cache = {}
-
-def anti_flood(user_id):
-    now = time.time()
-    if user_id in flood_cache:
-        if now - flood_cache[user_id] < 1.2:
-            return False
-    flood_cache[user_id] = now
-    return True
-
-async def is_subscribed(user_id: int, context: ContextTypes.DEFAULT_TYPE):
-    if user_id in sub_cache and sub_cache[user_id] is True:
-        return True
-
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "30"))
+CONNECTION_POOL_SIZE = int(os.getenv("CONNECTION_POOL_SIZE", "64"))
+POOL_TIMEOUT = float(os.getenv("POOL_TIMEOUT", "10"))
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+
+sub_cache = SubscriptionCache()
+ad_scheduler = AdScheduler(CHANNEL_USERNAME, ADMIN_ID)
+flood_limiter = RateLimiter({
+    "start": Rule(rate=1 / 3, capacity=2),
+    "callback": Rule(rate=1 / 1.2, capacity=3),
+    "message": Rule(rate=1, capacity=5),
+})
+
+def anti_flood(user_id, action):
+    return flood_limiter.allow(action, user_id)
+
+async def fetch_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE):
     try:
         member = await context.bot.get_chat_member(CHANNEL_USERNAME, user_id)
-        if member.status in ["member", "administrator", "creator"]:
-            sub_cache[user_id] = True
-            return True
-        return False
+        return member.status in ["member", "administrator", "creator"]
     except Exception as e:
         print("SUBSCRIBE ERROR:", e)
-        return False
+        metrics.SUBSCRIPTION_ERRORS.inc()
+        return None
+
+async def is_subscribed(user_id: int, context: ContextTypes.DEFAULT_TYPE, fresh=False):
+    if fresh:
+        sub_cache.invalidate(user_id)
+    return await sub_cache.get(user_id, lambda: fetch_subscription(user_id, context))
 
 async def send_subscribe_message(chat_id, context):
     keyboard = InlineKeyboardMarkup([
@@ -89,14 +120,11 @@ async def send_subscribe_message(chat_id, context):
         reply_markup=keyboard
     )
 
-async def send_menu(chat_id, user_id, context, first_name="User"):
-    bot_username = (await context.bot.get_me()).username
-    referral_link = f"https://t.me/{bot_username}?start={user_id}"
+def referral_link(context, user_id):
+    return f"{context.bot_data['referral_prefix']}{user_id}"
 
-    points = await get_user_points(user_id)
-    users_count = await total_users()
-    giveaway_status = await get_giveaway()
-    prize = await get_giveaway_prize()
+async def send_menu(chat_id, user_id, context, first_name="User"):
+    points, users_count, giveaway_status, prize = await get_menu_snapshot(user_id)
 
     keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton("👤 Profil", callback_data="profile")],
@@ -114,7 +142,7 @@ async def send_menu(chat_id, user_id, context, first_name="User"):
         f"🎯 Ballaringiz: {points}\n\n"
         f"🎁 Giveaway: {'✅ ACTIVE' if giveaway_status == 1 else '❌ OFF'}\n"
         f"🏆 Sovg‘a: {prize}\n\n"
-        f"🔗 Referral link:\n{referral_link}\n\n"
+        f"🔗 Referral link:\n{referral_link(context, user_id)}\n\n"
         f"📌 Odam chaqiring → ball yig‘ing!"
     )
 
@@ -124,7 +152,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     user_id = user.id
 
-    if not anti_flood(user_id):
+    if not anti_flood(user_id, "start"):
         return
 
     if await is_banned(user_id):
@@ -146,153 +174,195 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await send_menu(update.effective_chat.id, user_id, context, user.first_name)
 
-async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+ADS_PACKAGES = {
+    "ads_1h": ("1 soat", 10000),
+    "ads_6h": ("6 soat", 30000),
+    "ads_24h": ("24 soat", 60000),
+    "ads_pin": ("Pinned 24 soat", 100000),
+}
+
+def get_state(context):
+    return context.user_data.get("state")
+
+def set_state(context, state, **data):
+    context.user_data["state"] = state
+    context.user_data["state_data"] = data
+
+def clear_state(context):
+    context.user_data.pop("state", None)
+    context.user_data.pop("state_data", None)
+
+def find_route(routes, prefix_routes, data):
+    handler = routes.get(data)
+    if handler is not None:
+        return handler
+
+    for length in {len(prefix) for prefix in prefix_routes}:
+        handler = prefix_routes.get(data[:length])
+        if handler is not None:
+            return handler
+    return None
+
+async def on_check_sub(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
+    user_id = query.from_user.id
+
+    if await is_subscribed(user_id, context, fresh=True):
+        await query.message.reply_text("✅ Obuna tasdiqlandi!")
+        await send_menu(query.message.chat_id, user_id, context, query.from_user.first_name)
+    else:
+        await query.message.reply_text("❌ Siz hali kanalga obuna bo‘lmagansiz!")
 
+async def on_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
     user_id = query.from_user.id
 
-    if not anti_flood(user_id):
-        return
+    points = await get_user_points(user_id)
+    rank = await get_user_rank(user_id)
+    await query.message.reply_text(
+        f"👤 Profil\n\n"
+        f"👨 Ism: {query.from_user.first_name}\n"
+        f"🆔 ID: {user_id}\n"
+        f"🎯 Ball: {points}\n"
+        f"🏆 O‘rin: {rank if rank else '—'}"
+    )
 
-    if await is_banned(user_id):
-        await query.message.reply_text("❌ Siz bloklangansiz.")
-        return
+async def on_top(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    users = await top_users(10)
+    text = "🏆 Top 10:\n\n"
+    for i, (name, pts) in enumerate(users, start=1):
+        text += f"{i}) {name} — {pts}\n"
+    await update.callback_query.message.reply_text(text)
 
-    if query.data == "check_sub":
-        if await is_subscribed(user_id, context):
-            await query.message.reply_text("✅ Obuna tasdiqlandi!")
-            await send_menu(query.message.chat_id, user_id, context, query.from_user.first_name)
-        else:
-            await query.message.reply_text("❌ Siz hali kanalga obuna bo‘lmagansiz!")
+async def on_giveaway(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    status = await get_giveaway()
+    prize = await get_giveaway_prize()
 
-    elif query.data == "profile":
-        points = await get_user_points(user_id)
+    if status == 0:
+        await query.message.reply_text("❌ Giveaway OFF.")
+    else:
         await query.message.reply_text(
-            f"👤 Profil\n\n"
-            f"👨 Ism: {query.from_user.first_name}\n"
-            f"🆔 ID: {user_id}\n"
-            f"🎯 Ball: {points}"
+            f"🎁 Giveaway ACTIVE!\n\n"
+            f"🏆 Sovg‘a: {prize}\n\n"
+            f"📌 Qoidalar:\n"
+            f"• Referral orqali ball yig‘ing\n"
+            f"• Kimning bali ko‘p bo‘lsa o‘sha sovg‘a oladi"
         )
 
-    elif query.data == "top":
-        users = await top_users(10)
-        text = "🏆 Top 10:\n\n"
-        for i, (name, pts) in enumerate(users, start=1):
-            text += f"{i}) {name} — {pts}\n"
-        await query.message.reply_text(text)
+async def on_stats_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    users_count = await total_users()
+    await update.callback_query.message.reply_text(f"📊 Statistika\n\n👥 Jami userlar: {users_count}")
 
-    elif query.data == "giveaway":
-        status = await get_giveaway()
-        prize = await get_giveaway_prize()
+async def on_referral(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.message.reply_text(f"🔗 Referral link:\n\n{referral_link(context, query.from_user.id)}")
 
-        if status == 0:
-            await query.message.reply_text("❌ Giveaway OFF.")
-        else:
-            await query.message.reply_text(
-                f"🎁 Giveaway ACTIVE!\n\n"
-                f"🏆 Sovg‘a: {prize}\n\n"
-                f"📌 Qoidalar:\n"
-                f"• Referral orqali ball yig‘ing\n"
-                f"• Kimning bali ko‘p bo‘lsa o‘sha sovg‘a oladi"
-            )
-
-    elif query.data == "stats_user":
-        users_count = await total_users()
-        await query.message.reply_text(f"📊 Statistika\n\n👥 Jami userlar: {users_count}")
-
-    elif query.data == "referral":
-        bot_username = (await context.bot.get_me()).username
-        referral_link = f"https://t.me/{bot_username}?start={user_id}"
-        await query.message.reply_text(f"🔗 Referral link:\n\n{referral_link}")
-
-    elif query.data == "ads_menu":
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🕐 1 soat - 10 000 so‘m", callback_data="ads_1h")],
-            [InlineKeyboardButton("🕕 6 soat - 30 000 so‘m", callback_data="ads_6h")],
-            [InlineKeyboardButton("🕛 24 soat - 60 000 so‘m", callback_data="ads_24h")],
-            [InlineKeyboardButton("📌 Pinned 24h - 100 000 so‘m", callback_data="ads_pin")],
-        ])
-        await query.message.reply_text("📢 Reklama paketini tanlang:", reply_markup=keyboard)
-
-    elif query.data in ["ads_1h", "ads_6h", "ads_24h", "ads_pin"]:
-        packages = {
-            "ads_1h": ("1 soat", 10000),
-            "ads_6h": ("6 soat", 30000),
-            "ads_24h": ("24 soat", 60000),
-            "ads_pin": ("Pinned 24 soat", 100000),
-        }
-
-        package_name, price = packages[query.data]
-
-        context.user_data["ads_package"] = package_name
-        context.user_data["ads_price"] = price
-        context.user_data["ads_text_mode"] = True
+async def on_ads_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🕐 1 soat - 10 000 so‘m", callback_data="ads_1h")],
+        [InlineKeyboardButton("🕕 6 soat - 30 000 so‘m", callback_data="ads_6h")],
+        [InlineKeyboardButton("🕛 24 soat - 60 000 so‘m", callback_data="ads_24h")],
+        [InlineKeyboardButton("📌 Pinned 24h - 100 000 so‘m", callback_data="ads_pin")],
+    ])
+    await update.callback_query.message.reply_text("📢 Reklama paketini tanlang:", reply_markup=keyboard)
 
-        await query.message.reply_text(
-            f"✅ Paket: {package_name}\n"
-            f"💰 Narx: {price} so‘m\n\n"
-            f"📌 Endi reklama matnini yuboring:"
-        )
+async def on_ads_package(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    package_name, price = ADS_PACKAGES[query.data]
 
-async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
+    set_state(context, "ads_text", package=package_name, price=price)
 
-    if context.user_data.get("ads_text_mode"):
-        if update.message.text is None:
-            await update.message.reply_text("❗ Reklama matnini TEXT qilib yuboring.")
-            return
+    await query.message.reply_text(
+        f"✅ Paket: {package_name}\n"
+        f"💰 Narx: {price} so‘m\n\n"
+        f"📌 Endi reklama matnini yuboring:"
+    )
 
-        context.user_data["ads_text_mode"] = False
+CALLBACK_ROUTES = {
+    "check_sub": on_check_sub,
+    "profile": on_profile,
+    "top": on_top,
+    "giveaway": on_giveaway,
+    "stats_user": on_stats_user,
+    "referral": on_referral,
+    "ads_menu": on_ads_menu,
+    **{data: on_ads_package for data in ADS_PACKAGES},
+}
 
-        package_name = context.user_data.get("ads_package")
-        price = context.user_data.get("ads_price")
-        ad_text = update.message.text.strip()
+async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
 
-        await create_ads_order(user_id, package_name, price, ad_text)
+    user_id = query.from_user.id
 
-        context.user_data["waiting_receipt"] = True
+    if not anti_flood(user_id, "callback"):
+        return
 
-        await update.message.reply_text(
-            f"✅ Reklama buyurtmangiz yaratildi!\n\n"
-            f"📦 Paket: {package_name}\n"
-            f"💰 Narx: {price} so‘m\n\n"
-            f"💳 To‘lov:\n"
-            f"👤 Egasi: {PAYMENT_OWNER}\n"
-            f"💳 Karta: {PAYMENT_CARD}\n\n"
-            f"📌 Endi chek screenshot yuboring!"
-        )
+    if await is_banned(user_id):
+        await query.message.reply_text("❌ Siz bloklangansiz.")
         return
 
-    if context.user_data.get("waiting_receipt"):
-        if not update.message.photo:
-            await update.message.reply_text("❗ Chekni rasm ko‘rinishida yuboring (screenshot).")
-            return
+    handler = CALLBACK_ROUTES.get(query.data)
+    if handler is not None:
+        await handler(update, context)
 
-        context.user_data["waiting_receipt"] = False
-        receipt_file_id = update.message.photo[-1].file_id
+async def on_ads_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.text is None:
+        await update.message.reply_text("❗ Reklama matnini TEXT qilib yuboring.")
+        return
 
-        last = await get_last_pending_order(user_id)
-        if not last:
-            await update.message.reply_text("❌ Sizda aktiv reklama order yo‘q.")
-            return
+    state_data = context.user_data.get("state_data", {})
+    package_name = state_data.get("package")
+    price = state_data.get("price")
+    ad_text = update.message.text.strip()
 
-        order_id = last[0]
-        await attach_receipt(order_id, receipt_file_id)
+    await create_ads_order(update.effective_user.id, package_name, price, ad_text)
 
-        await update.message.reply_text("✅ Chek qabul qilindi! Admin tekshiradi.")
+    set_state(context, "waiting_receipt")
 
-        order = await get_ads_order(order_id)
-        oid, uid, package, price, ad_text, receipt, status = order
+    await update.message.reply_text(
+        f"✅ Reklama buyurtmangiz yaratildi!\n\n"
+        f"📦 Paket: {package_name}\n"
+        f"💰 Narx: {price} so‘m\n\n"
+        f"💳 To‘lov:\n"
+        f"👤 Egasi: {PAYMENT_OWNER}\n"
+        f"💳 Karta: {PAYMENT_CARD}\n\n"
+        f"📌 Endi chek screenshot yuboring!"
+    )
 
-        keyboard = InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("✅ Tasdiqlash", callback_data=f"approve_{oid}"),
-                InlineKeyboardButton("❌ Rad etish", callback_data=f"reject_{oid}")
-            ]
-        ])
+async def on_receipt(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.message.photo:
+        await update.message.reply_text("❗ Chekni rasm ko‘rinishida yuboring (screenshot).")
+        return
+
+    clear_state(context)
+    receipt_file_id = update.message.photo[-1].file_id
+
+    last = await get_last_pending_order(update.effective_user.id)
+    if not last:
+        await update.message.reply_text("❌ Sizda aktiv reklama order yo‘q.")
+        return
+
+    order_id = last[0]
+    await attach_receipt(order_id, receipt_file_id)
+
+    await update.message.reply_text("✅ Chek qabul qilindi! Admin tekshiradi.")
+
+    order = await get_ads_order(order_id)
+    oid, uid, package, price, ad_text, receipt, status = order
+
+    keyboard = InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("✅ Tasdiqlash", callback_data=f"approve_{oid}"),
+            InlineKeyboardButton("❌ Rad etish", callback_data=f"reject_{oid}")
+        ]
+    ])
 
-        await context.bot.send_photo(
+    # Sent outside the handler: waiting on the admin chat's own rate limit
+    # would hold this user's processor slot and stall everyone else.
+    context.application.create_task(
+        context.bot.send_photo(
             chat_id=ADMIN_ID,
             photo=receipt_file_id,
             caption=
@@ -302,113 +372,148 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"📦 Paket: {package}\n"
             f"💰 Narx: {price} so‘m\n\n"
             f"📝 Reklama:\n{ad_text}",
-            reply_markup=keyboard
-        )
+            reply_markup=keyboard,
+            rate_limit_args=PRIORITY_BULK
+        ),
+        update=update
+    )
+
+async def on_broadcast_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    clear_state(context)
+    text = update.message.text.strip()
+    broadcast_id, total = await create_broadcast(text, ADMIN_ID)
+
+    await update.message.reply_text(f"⏳ Broadcast navbatga qo‘yildi! ({total} ta user)")
+    start_broadcast(context.application, broadcast_id)
+
+async def reply_summary(update, title, results, invalid):
+    text, details = summary(title, results, invalid)
+    if details is None:
+        await update.message.reply_text(text)
+    else:
+        await update.message.reply_document(document=details, filename="natija.csv", caption=text)
+
+async def on_bulk_ban(update: Update, context: ContextTypes.DEFAULT_TYPE, banned):
+    clear_state(context)
+    try:
+        ids, invalid = parse_ids(await read_input(update.message))
+    except ValueError:
+        await update.message.reply_text("❌ Fayl juda katta yoki UTF-8 emas!")
         return
 
-    if user_id == ADMIN_ID:
-        if update.message.text is None:
-            return
+    if not ids:
+        await update.message.reply_text("❌ ID xato!")
+        return
 
-        text = update.message.text.strip()
+    if len(ids) > MAX_ROWS:
+        await update.message.reply_text(f"❌ Juda ko‘p ID: {len(ids)} (maks {MAX_ROWS}). Bo‘lib yuboring.")
+        return
 
-        if context.user_data.get("broadcast_mode"):
-            context.user_data["broadcast_mode"] = False
-            users = await get_all_users()
+    results = await set_banned_bulk(ids, banned)
+    await reply_summary(update, "🚫 Ban natijasi" if banned else "✅ Unban natijasi", results, invalid)
 
-            sent = 0
-            failed = 0
+async def on_ban_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await on_bulk_ban(update, context, banned=True)
 
-            await update.message.reply_text("⏳ Broadcast yuborilmoqda...")
+async def on_unban_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await on_bulk_ban(update, context, banned=False)
 
-            for uid in users:
-                try:
-                    await context.bot.send_message(chat_id=uid, text=text)
-                    sent += 1
-                except:
-                    failed += 1
+async def on_bulk_points(update: Update, context: ContextTypes.DEFAULT_TYPE, sign):
+    clear_state(context)
+    try:
+        rows, invalid = parse_point_rows(await read_input(update.message), sign)
+    except ValueError:
+        await update.message.reply_text("❌ Fayl juda katta yoki UTF-8 emas!")
+        return
 
-            await update.message.reply_text(f"✅ Tugadi!\n\nYuborildi: {sent}\nXato: {failed}")
-            return
+    if not rows:
+        await update.message.reply_text("❌ Format: user_id ball")
+        return
 
-        if context.user_data.get("ban_mode"):
-            context.user_data["ban_mode"] = False
-            try:
-                uid = int(text)
-                await ban_user(uid)
-                await update.message.reply_text(f"🚫 Ban qilindi: {uid}")
-            except:
-                await update.message.reply_text("❌ ID xato!")
-            return
+    if len(rows) > MAX_ROWS:
+        await update.message.reply_text(f"❌ Juda ko‘p qator: {len(rows)} (maks {MAX_ROWS}). Bo‘lib yuboring.")
+        return
 
-        if context.user_data.get("unban_mode"):
-            context.user_data["unban_mode"] = False
-            try:
-                uid = int(text)
-                await unban_user(uid)
-                await update.message.reply_text(f"✅ Unban qilindi: {uid}")
-            except:
-                await update.message.reply_text("❌ ID xato!")
-            return
+    results = await adjust_points_bulk(rows)
+    await reply_summary(update, "➕ Ball qo‘shildi" if sign > 0 else "➖ Ball ayirildi", results, invalid)
 
-        if context.user_data.get("add_points_mode"):
-            context.user_data["add_points_mode"] = False
-            try:
-                uid, pts = text.split()
-                await add_points(int(uid), int(pts))
-                await update.message.reply_text(f"➕ {uid} ga {pts} ball qo‘shildi.")
-            except:
-                await update.message.reply_text("❌ Format: user_id ball")
-            return
+async def on_add_points(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await on_bulk_points(update, context, sign=1)
 
-        if context.user_data.get("remove_points_mode"):
-            context.user_data["remove_points_mode"] = False
-            try:
-                uid, pts = text.split()
-                await remove_points(int(uid), int(pts))
-                await update.message.reply_text(f"➖ {uid} dan {pts} ball ayirildi.")
-            except:
-                await update.message.reply_text("❌ Format: user_id ball")
-            return
+async def on_remove_points(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await on_bulk_points(update, context, sign=-1)
 
-        if context.user_data.get("userinfo_mode"):
-            context.user_data["userinfo_mode"] = False
-            try:
-                uid = int(text)
-                info = await get_user_info(uid)
-
-                if not info:
-                    await update.message.reply_text("❌ User topilmadi.")
-                    return
-
-                uid, username, name, pts, banned = info
-                await update.message.reply_text(
-                    f"👤 USER INFO\n\n"
-                    f"🆔 ID: {uid}\n"
-                    f"👨 Ism: {name}\n"
-                    f"🔗 Username: @{username}\n"
-                    f"🎯 Ball: {pts}\n"
-                    f"🚫 Ban: {'Ha' if banned == 1 else 'Yo‘q'}"
-                )
-            except:
-                await update.message.reply_text("❌ ID xato!")
+async def on_userinfo_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    clear_state(context)
+    try:
+        uid = int(update.message.text.strip())
+        info = await get_user_info(uid)
+
+        if not info:
+            await update.message.reply_text("❌ User topilmadi.")
             return
 
-        if context.user_data.get("prize_custom_mode"):
-            context.user_data["prize_custom_mode"] = False
-            await set_giveaway_prize(text)
-            await update.message.reply_text(f"✅ Prize saqlandi: {text}")
+        uid, username, name, pts, banned = info
+        await update.message.reply_text(
+            f"👤 USER INFO\n\n"
+            f"🆔 ID: {uid}\n"
+            f"👨 Ism: {name}\n"
+            f"🔗 Username: @{username}\n"
+            f"🎯 Ball: {pts}\n"
+            f"🚫 Ban: {'Ha' if banned == 1 else 'Yo‘q'}"
+        )
+    except:
+        await update.message.reply_text("❌ ID xato!")
+
+async def on_custom_prize(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    clear_state(context)
+    text = update.message.text.strip()
+    await set_giveaway_prize(text)
+    await update.message.reply_text(f"✅ Prize saqlandi: {text}")
+
+# state -> (handler, admin_only)
+STATE_HANDLERS = {
+    "ads_text": (on_ads_text, False),
+    "waiting_receipt": (on_receipt, False),
+    "broadcast": (on_broadcast_text, True),
+    "ban": (on_ban_id, True),
+    "unban": (on_unban_id, True),
+    "add_points": (on_add_points, True),
+    "remove_points": (on_remove_points, True),
+    "userinfo": (on_userinfo_id, True),
+    "prize_custom": (on_custom_prize, True),
+}
+
+# admin states that also accept an uploaded CSV instead of text
+DOCUMENT_STATES = {"ban", "unban", "add_points", "remove_points"}
+
+async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+
+    if not anti_flood(user_id, "message"):
+        return
+
+    state = get_state(context)
+    route = STATE_HANDLERS.get(state)
+    if route is None:
+        return
+
+    handler, admin_only = route
+    if admin_only:
+        if user_id != ADMIN_ID:
+            return
+        has_document = update.message.document is not None and state in DOCUMENT_STATES
+        if update.message.text is None and not has_document:
             return
 
+    await handler(update, context)
+
 async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
         await update.message.reply_text("❌ Admin emassiz.")
         return
 
-    users_count = await total_users()
-    banned_count = await total_banned()
-    giveaway_status = await get_giveaway()
-    prize = await get_giveaway_prize()
+    users_count, banned_count, giveaway_status, prize = await get_admin_snapshot()
 
     keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton("👥 User ro‘yxati", callback_data="admin_users_1")],
@@ -437,217 +542,494 @@ async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=keyboard
     )
 
-async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
+async def reconcile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Admin emassiz.")
+        return
 
-    if query.from_user.id != ADMIN_ID:
+    users_count, banned_count = await rebuild_counters()
+    await update.message.reply_text(
+        f"✅ Hisoblagichlar qayta hisoblandi!\n\n"
+        f"👥 Userlar: {users_count}\n"
+        f"🚫 Ban: {banned_count}"
+    )
+
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Admin emassiz.")
         return
 
-    data = query.data
+    args = [arg.lower() for arg in context.args]
+    table = TABLE_ALIASES.get(args[0] if args else "users")
+    fmt = args[1] if len(args) > 1 else "csv"
+    if table is None or fmt not in FORMATS:
+        await update.message.reply_text("❗ Format: /export users|orders csv|jsonl")
+        return
 
-    if data.startswith("admin_users_"):
-        page = int(data.split("_")[-1])
-        users = await get_users_page(page=page, per_page=10)
+    await update.message.reply_text("⏳ Eksport tayyorlanmoqda...")
+    context.application.create_task(
+        send_export(context.bot, update.effective_chat.id, table, fmt),
+        update=update
+    )
 
-        if not users:
-            await query.message.reply_text("❌ User yo‘q.")
-            return
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    return f"{days}d {hours}h {minutes}m" if days else f"{hours}h {minutes}m {seconds}s"
+
+def histogram_summary(histogram, limit=None):
+    rows = sorted(histogram.items(), key=lambda item: -item[1][2])
+    lines = []
+    for labels, (_, total, count) in rows[:limit]:
+        p95 = histogram.quantile(0.95, *labels) * 1000
+        lines.append(f"• {'/'.join(labels) or 'all'}: {count} ta, o‘rtacha {total / count * 1000:.1f} ms, p95 ≤ {p95:g} ms")
+    return lines
+
+async def show_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ Admin emassiz.")
+        return
 
-        text = f"👥 USER RO‘YXATI (Page {page})\n\n"
-        for uid, name, pts in users:
-            text += f"🆔 {uid} | {name} | 🎯 {pts}\n"
+    processor = context.application.update_processor
+    limiter = context.bot.rate_limiter
+    db_calls = {}
+    for (kind, _), (_, total, count) in metrics.DB_SECONDS.items():
+        calls, seconds = db_calls.get(kind, (0, 0.0))
+        db_calls[kind] = (calls + count, seconds + total)
+
+    lines = [
+        "📊 METRIKALAR",
+        "",
+        f"⏱ Ishlash vaqti: {format_duration(time.time() - metrics.started_at)}",
+        f"📨 Updatelar: {processor.processed} ta, navbatda {processor.queued}, ishlayapti {processor.running}",
+        "",
+        "🐢 Handlerlar:",
+        *histogram_summary(metrics.HANDLER_SECONDS, limit=8),
+        "",
+        "🗄 DB:",
+        *(
+            f"• {kind}: {calls} ta, o‘rtacha {seconds / calls * 1000:.2f} ms"
+            for kind, (calls, seconds) in sorted(db_calls.items()) if calls
+        ),
+        *(
+            f"• {kind} kutish: p95 ≤ {metrics.DB_WAIT_SECONDS.quantile(0.95, kind) * 1000:g} ms"
+            for (kind,), _ in sorted(metrics.DB_WAIT_SECONDS.items())
+        ),
+        "",
+        f"📡 Telegram: {metrics.TELEGRAM_REQUESTS.total()} so‘rov, "
+        f"429: {metrics.TELEGRAM_RETRY_AFTER.total()}, xato: {metrics.TELEGRAM_ERRORS.total()}",
+        f"💾 Kesh: user {user_cache.hit_rate:.0%}, obuna {sub_cache.hit_rate:.0%}",
+        f"📦 Navbatlar: update {context.application.update_queue.qsize()}, "
+        f"DB yozish {pending_writes()}, chiquvchi {len(limiter.overall)}, "
+        f"reklama {len(ad_scheduler)}, broadcast {running_broadcasts()}",
+    ]
+    await update.message.reply_text("\n".join(lines))
+
+def register_gauges(app):
+    processor = app.update_processor
+    limiter = app.bot.rate_limiter
+
+    metrics.Gauge("bot_update_queue_size", "Updates received but not yet picked up.", app.update_queue.qsize)
+    metrics.Gauge("bot_updates_waiting", "Updates waiting for their user's turn or a slot.", lambda: processor.queued)
+    metrics.Gauge("bot_updates_running", "Updates being handled right now.", lambda: processor.running)
+    metrics.Gauge("bot_db_pending_writes", "Writes waiting in the write-behind batch.", pending_writes)
+    metrics.Gauge("bot_outbound_waiting", "Bot API calls waiting for a global token.", lambda: len(limiter.overall))
+    metrics.Gauge("bot_persistence_pending", "Changed user/chat/bot data not yet saved.", lambda: app.persistence.pending_count)
+    metrics.Gauge("bot_ad_timers", "Scheduled ad publish and expiry timers.", lambda: len(ad_scheduler))
+    metrics.Gauge("bot_broadcasts_running", "Broadcasts currently sending.", running_broadcasts)
+    metrics.Gauge("bot_leaderboard_size", "Users held in the in-memory leaderboard.", lambda: len(leaderboard))
+    metrics.Gauge(
+        "bot_cache_size", "Entries held per cache.",
+        lambda: {("user",): len(user_cache), ("subscription",): len(sub_cache)},
+        labels=("cache",)
+    )
+    metrics.Gauge(
+        "bot_cache_hits_total", "Cache hits.",
+        lambda: {("user",): user_cache.hits, ("subscription",): sub_cache.hits},
+        labels=("cache",), kind="counter"
+    )
+    metrics.Gauge(
+        "bot_cache_misses_total", "Cache misses.",
+        lambda: {("user",): user_cache.misses, ("subscription",): sub_cache.misses},
+        labels=("cache",), kind="counter"
+    )
+    metrics.Gauge(
+        "bot_subscription_coalesced_total", "Membership checks answered by an in-flight request.",
+        lambda: sub_cache.coalesced, kind="counter"
+    )
+    metrics.Gauge(
+        "bot_flood_drops_total", "Updates dropped by the anti-flood limiter.",
+        lambda: {(action,): count for action, count in flood_limiter.drops.items()},
+        labels=("action",), kind="counter"
+    )
 
-        nav_buttons = []
-        if page > 1:
-            nav_buttons.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=f"admin_users_{page-1}"))
-        nav_buttons.append(InlineKeyboardButton("➡️ Keyingi", callback_data=f"admin_users_{page+1}"))
+async def on_admin_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    parts = query.data.split("_")[2:]
+    page = int(parts[0])
+
+    if len(parts) == 4:
+        direction, points, uid = parts[1], int(parts[2]), int(parts[3])
+        users, has_more = await get_users_page((points, uid), per_page=10, backward=direction == "p")
+    else:
+        direction = "n"
+        users, has_more = await get_users_page(per_page=10)
+
+    if not users:
+        await query.message.reply_text("❌ User yo‘q.")
+        return
 
-        await query.message.reply_text(text, reply_markup=InlineKeyboardMarkup([nav_buttons]))
+    text = f"👥 USER RO‘YXATI (Page {page})\n\n"
+    for uid, name, pts in users:
+        text += f"🆔 {uid} | {name} | 🎯 {pts}\n"
+
+    first_uid, _, first_pts = users[0]
+    last_uid, _, last_pts = users[-1]
+    has_next = has_more if direction == "n" else True
+
+    nav_buttons = []
+    if page > 1:
+        nav_buttons.append(InlineKeyboardButton(
+            "⬅️ Oldingi", callback_data=f"admin_users_{page-1}_p_{first_pts}_{first_uid}"
+        ))
+    if has_next:
+        nav_buttons.append(InlineKeyboardButton(
+            "➡️ Keyingi", callback_data=f"admin_users_{page+1}_n_{last_pts}_{last_uid}"
+        ))
+
+    await query.message.reply_text(
+        text,
+        reply_markup=InlineKeyboardMarkup([nav_buttons]) if nav_buttons else None
+    )
 
-    elif data == "admin_ads":
-        orders = await get_waiting_orders()
+ADS_PAGE_SIZE = 5
 
-        if not orders:
-            await query.message.reply_text("📦 Tasdiqlash uchun reklama order yo‘q.")
-            return
+async def send_order_card(context, oid):
+    order = await get_ads_order(oid)
+    if not order or order[6] != "waiting_admin":
+        return False
 
-        for oid, uid, package, price, ad_text, receipt in orders[:5]:
-            keyboard = InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("✅ Tasdiqlash", callback_data=f"approve_{oid}"),
-                    InlineKeyboardButton("❌ Rad etish", callback_data=f"reject_{oid}")
-                ]
-            ])
-
-            await context.bot.send_photo(
-                chat_id=ADMIN_ID,
-                photo=receipt,
-                caption=
-                f"📦 Order ID: {oid}\n"
-                f"👤 User: {uid}\n"
-                f"📦 Paket: {package}\n"
-                f"💰 Narx: {price} so‘m\n\n"
-                f"📝 Reklama:\n{ad_text}",
-                reply_markup=keyboard
-            )
-
-    elif data.startswith("approve_"):
-        oid = int(data.split("_")[1])
-        order = await get_ads_order(oid)
-
-        if not order:
-            await query.message.reply_text("❌ Order topilmadi.")
-            return
+    oid, uid, package, price, ad_text, receipt, status = order
+    keyboard = InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("✅ Tasdiqlash", callback_data=f"approve_{oid}"),
+            InlineKeyboardButton("❌ Rad etish", callback_data=f"reject_{oid}")
+        ]
+    ])
 
-        oid, uid, package, price, ad_text, receipt, status = order
-        await set_ads_status(oid, "approved")
+    await context.bot.send_photo(
+        chat_id=ADMIN_ID,
+        photo=receipt,
+        caption=
+        f"📦 Order ID: {oid}\n"
+        f"👤 User: {uid}\n"
+        f"📦 Paket: {package}\n"
+        f"💰 Narx: {price} so‘m\n\n"
+        f"📝 Reklama:\n{ad_text}",
+        reply_markup=keyboard
+    )
+    return True
 
-        await context.bot.send_message(chat_id=CHANNEL_USERNAME, text=ad_text)
+async def on_admin_ads(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    # Orders are reviewed oldest first; everything up to ads_cursor has
+    # already been sent to the admin and is not sent again.
+    if query.data == "admin_ads_reset":
+        context.user_data.pop("ads_cursor", None)
+    cursor = context.user_data.get("ads_cursor", 0)
+
+    ids, has_more = await get_waiting_order_ids(cursor, ADS_PAGE_SIZE)
+    if not ids:
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔄 Boshidan", callback_data="admin_ads_reset")]
+        ]) if cursor else None
+        await query.message.reply_text("📦 Yangi reklama order yo‘q.", reply_markup=keyboard)
+        return
 
-        await context.bot.send_message(
-            chat_id=uid,
-            text="✅ Reklamangiz tasdiqlandi va kanalga joylandi!"
-        )
+    results = await asyncio.gather(
+        *(send_order_card(context, oid) for oid in ids),
+        return_exceptions=True
+    )
 
-        await query.message.reply_text(f"✅ Order tasdiqlandi! (ID: {oid})")
+    # The cursor only moves past cards that were sent or are no longer
+    # waiting; a card that failed is sent again with the next page.
+    shown = failed = 0
+    for oid, result in zip(ids, results):
+        if isinstance(result, Exception):
+            print("ORDER CARD ERROR:", oid, result)
+            failed += 1
+            continue
+        if result:
+            shown += 1
+        if not failed:
+            cursor = oid
+    context.user_data["ads_cursor"] = cursor
+
+    buttons = [InlineKeyboardButton("🔄 Boshidan", callback_data="admin_ads_reset")]
+    if has_more or failed:
+        buttons.insert(0, InlineKeyboardButton("➡️ Keyingi", callback_data="admin_ads"))
+
+    text = f"📦 {shown} ta order ko‘rsatildi (ID {ids[0]}–{ids[-1]})."
+    if failed:
+        text += f"\n❌ {failed} ta order yuborilmadi, keyingi safar qayta yuboriladi."
+
+    await query.message.reply_text(text, reply_markup=InlineKeyboardMarkup([buttons]))
+
+async def on_approve(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    oid = int(query.data.split("_")[1])
+    order = await get_ads_order(oid)
 
-    elif data.startswith("reject_"):
-        oid = int(data.split("_")[1])
-        order = await get_ads_order(oid)
+    if not order:
+        await query.message.reply_text("❌ Order topilmadi.")
+        return
 
-        if not order:
-            await query.message.reply_text("❌ Order topilmadi.")
-            return
+    oid, uid, package, price, ad_text, receipt, status = order
+    expires_at = await ad_scheduler.schedule(oid, package)
+    if expires_at is None:
+        await query.message.reply_text(f"⚠️ Order allaqachon ko‘rib chiqilgan. (ID: {oid})")
+        return
 
-        oid, uid, package, price, ad_text, receipt, status = order
-        await set_ads_status(oid, "rejected")
+    await context.bot.send_message(
+        chat_id=uid,
+        text="✅ Reklamangiz tasdiqlandi! Tez orada kanalga joylanadi."
+    )
 
-        await context.bot.send_message(
-            chat_id=uid,
-            text="❌ Reklama buyurtmangiz admin tomonidan rad etildi."
-        )
+    until = time.strftime("%d.%m.%Y %H:%M", time.localtime(expires_at))
+    await query.message.reply_text(f"✅ Order tasdiqlandi! (ID: {oid})\n⏰ Kanalda {until} gacha turadi.")
 
-        await query.message.reply_text(f"❌ Order rad etildi. (ID: {oid})")
+async def on_reject(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    oid = int(query.data.split("_")[1])
+    order = await get_ads_order(oid)
 
-    elif data == "admin_broadcast":
-        context.user_data["broadcast_mode"] = True
-        await query.message.reply_text("📢 Broadcast matnini yuboring:")
+    if not order:
+        await query.message.reply_text("❌ Order topilmadi.")
+        return
 
-    elif data == "admin_giveaway_on":
-        prize = await get_giveaway_prize()
+    oid, uid, package, price, ad_text, receipt, status = order
+    if status != "waiting_admin":
+        await query.message.reply_text(f"⚠️ Order allaqachon ko‘rib chiqilgan. (ID: {oid})")
+        return
 
-        if prize == "🎁 Sovg‘a yo‘q":
-            await query.message.reply_text("❌ Prize tanlanmagan!\n\nAvval 🎁 Prize tanlang.")
-            return
+    await set_ads_status(oid, "rejected")
 
-        await set_giveaway(1)
-        await query.message.reply_text(f"✅ Giveaway yoqildi!\n🎁 Prize: {prize}")
+    await context.bot.send_message(
+        chat_id=uid,
+        text="❌ Reklama buyurtmangiz admin tomonidan rad etildi."
+    )
 
-    elif data == "admin_giveaway_off":
-        await set_giveaway(0)
-        await query.message.reply_text("❌ Giveaway o‘chirildi!")
+    await query.message.reply_text(f"❌ Order rad etildi. (ID: {oid})")
 
-    elif data == "admin_set_prize":
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🖼 NFT", callback_data="prize_nft")],
-            [InlineKeyboardButton("🎁 Gift", callback_data="prize_gift")],
-            [InlineKeyboardButton("⭐ Stars", callback_data="prize_stars")],
-            [InlineKeyboardButton("✍️ Custom prize", callback_data="prize_custom")]
-        ])
-        await query.message.reply_text("🎁 Sovg‘ani tanlang:", reply_markup=keyboard)
-
-    elif data == "prize_nft":
-        await set_giveaway_prize("🖼 NFT")
-        await query.message.reply_text("✅ Prize tanlandi: 🖼 NFT")
-
-    elif data == "prize_gift":
-        await set_giveaway_prize("🎁 Telegram Gift")
-        await query.message.reply_text("✅ Prize tanlandi: 🎁 Telegram Gift")
-
-    elif data == "prize_stars":
-        await set_giveaway_prize("⭐ Telegram Stars")
-        await query.message.reply_text("✅ Prize tanlandi: ⭐ Telegram Stars")
-
-    elif data == "prize_custom":
-        context.user_data["prize_custom_mode"] = True
-        await query.message.reply_text("✍️ Prize nomini yozing (misol: ⭐ 200 Stars yoki 🎁 Premium 1 oy)")
-
-    elif data == "admin_winner_top":
-        status = await get_giveaway()
-        if status == 0:
-            await query.message.reply_text("❌ Giveaway OFF.")
-            return
+async def on_giveaway_on(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    prize = await get_giveaway_prize()
 
-        prize = await get_giveaway_prize()
-        top_user = await get_top_user()
+    if prize == "🎁 Sovg‘a yo‘q":
+        await query.message.reply_text("❌ Prize tanlanmagan!\n\nAvval 🎁 Prize tanlang.")
+        return
 
-        if not top_user:
-            await query.message.reply_text("❌ User topilmadi.")
-            return
+    await set_giveaway(1)
+    await query.message.reply_text(f"✅ Giveaway yoqildi!\n🎁 Prize: {prize}")
 
-        uid, name, pts = top_user
+async def on_giveaway_off(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await set_giveaway(0)
+    await update.callback_query.message.reply_text("❌ Giveaway o‘chirildi!")
 
-        await query.message.reply_text(
-            f"🏆 TOP WINNER!\n\n"
-            f"👤 Ism: {name}\n"
-            f"🆔 ID: {uid}\n"
-            f"🎯 Ball: {pts}\n\n"
-            f"🎁 Sovg‘a: {prize}"
-        )
+async def on_set_prize(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🖼 NFT", callback_data="prize_nft")],
+        [InlineKeyboardButton("🎁 Gift", callback_data="prize_gift")],
+        [InlineKeyboardButton("⭐ Stars", callback_data="prize_stars")],
+        [InlineKeyboardButton("✍️ Custom prize", callback_data="prize_custom")]
+    ])
+    await update.callback_query.message.reply_text("🎁 Sovg‘ani tanlang:", reply_markup=keyboard)
 
-        try:
-            await context.bot.send_message(
-                chat_id=uid,
-                text=
-                f"🎉 TABRIKLAYMIZ!\n\n"
-                f"🏆 Siz eng ko‘p ball yig‘ib winner bo‘ldingiz!\n\n"
-                f"🎯 Ball: {pts}\n"
-                f"🎁 Sovg‘a: {prize}\n\n"
-                f"📌 Admin siz bilan bog‘lanadi."
-            )
-        except:
-            await query.message.reply_text("⚠️ Winnerga xabar yuborilmadi (user botni bloklagan).")
+PRESET_PRIZES = {
+    "prize_nft": "🖼 NFT",
+    "prize_gift": "🎁 Telegram Gift",
+    "prize_stars": "⭐ Telegram Stars",
+}
 
-    elif data == "admin_ban":
-        context.user_data["ban_mode"] = True
-        await query.message.reply_text("🚫 Ban qilinadigan user ID yuboring:")
+async def on_preset_prize(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    prize = PRESET_PRIZES[query.data]
+    await set_giveaway_prize(prize)
+    await query.message.reply_text(f"✅ Prize tanlandi: {prize}")
 
-    elif data == "admin_unban":
-        context.user_data["unban_mode"] = True
-        await query.message.reply_text("✅ Unban qilinadigan user ID yuboring:")
+async def on_winner_top(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    status = await get_giveaway()
+    if status == 0:
+        await query.message.reply_text("❌ Giveaway OFF.")
+        return
 
-    elif data == "admin_add_points":
-        context.user_data["add_points_mode"] = True
-        await query.message.reply_text("➕ Format: user_id ball")
+    prize = await get_giveaway_prize()
+    top_user = await get_top_user()
 
-    elif data == "admin_remove_points":
-        context.user_data["remove_points_mode"] = True
-        await query.message.reply_text("➖ Format: user_id ball")
+    if not top_user:
+        await query.message.reply_text("❌ User topilmadi.")
+        return
 
-    elif data == "admin_userinfo":
-        context.user_data["userinfo_mode"] = True
-        await query.message.reply_text("🔍 User ID yuboring:")
+    uid, name, pts = top_user
 
-async def run_bot():
-    await init_db()
+    await query.message.reply_text(
+        f"🏆 TOP WINNER!\n\n"
+        f"👤 Ism: {name}\n"
+        f"🆔 ID: {uid}\n"
+        f"🎯 Ball: {pts}\n\n"
+        f"🎁 Sovg‘a: {prize}"
+    )
 
-    app = Application.builder().token(TOKEN).build()
+    try:
+        await context.bot.send_message(
+            chat_id=uid,
+            text=
+            f"🎉 TABRIKLAYMIZ!\n\n"
+            f"🏆 Siz eng ko‘p ball yig‘ib winner bo‘ldingiz!\n\n"
+            f"🎯 Ball: {pts}\n"
+            f"🎁 Sovg‘a: {prize}\n\n"
+            f"📌 Admin siz bilan bog‘lanadi."
+        )
+    except:
+        await query.message.reply_text("⚠️ Winnerga xabar yuborilmadi (user botni bloklagan).")
+
+def ask_for(state, prompt):
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        set_state(context, state)
+        await update.callback_query.message.reply_text(prompt)
+    return handler
+
+ADMIN_ROUTES = {
+    "admin_ads": on_admin_ads,
+    "admin_ads_reset": on_admin_ads,
+    "admin_broadcast": ask_for("broadcast", "📢 Broadcast matnini yuboring:"),
+    "admin_giveaway_on": on_giveaway_on,
+    "admin_giveaway_off": on_giveaway_off,
+    "admin_set_prize": on_set_prize,
+    "prize_custom": ask_for("prize_custom", "✍️ Prize nomini yozing (misol: ⭐ 200 Stars yoki 🎁 Premium 1 oy)"),
+    "admin_winner_top": on_winner_top,
+    "admin_ban": ask_for("ban", "🚫 Ban qilinadigan user ID(lar)ni yuboring:\n(bir nechta ID yoki CSV fayl)"),
+    "admin_unban": ask_for("unban", "✅ Unban qilinadigan user ID(lar)ni yuboring:\n(bir nechta ID yoki CSV fayl)"),
+    "admin_add_points": ask_for("add_points", "➕ Format: user_id ball\n(har qatorda bittadan yoki CSV fayl)"),
+    "admin_remove_points": ask_for("remove_points", "➖ Format: user_id ball\n(har qatorda bittadan yoki CSV fayl)"),
+    "admin_userinfo": ask_for("userinfo", "🔍 User ID yuboring:"),
+    **{data: on_preset_prize for data in PRESET_PRIZES},
+}
+
+ADMIN_PREFIX_ROUTES = {
+    "admin_users_": on_admin_users,
+    "approve_": on_approve,
+    "reject_": on_reject,
+}
 
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("admin", admin))
+async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
 
-    app.add_handler(CallbackQueryHandler(admin_callback, pattern="^(admin_|approve_|reject_|prize_)"))
-    app.add_handler(CallbackQueryHandler(callback_handler))
-    app.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, message_handler))
+    if query.from_user.id != ADMIN_ID:
+        return
+
+    handler = find_route(ADMIN_ROUTES, ADMIN_PREFIX_ROUTES, query.data)
+    if handler is not None:
+        await handler(update, context)
+
+def callback_route(update, context):
+    data = update.callback_query.data or ""
+    if data in CALLBACK_ROUTES or data in ADMIN_ROUTES:
+        return data
+    for prefix in ADMIN_PREFIX_ROUTES:
+        if data.startswith(prefix):
+            return prefix
+    return "other"
+
+def build_app():
+    app = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(f"{TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        .persistence(SQLitePersistence())
+        .concurrent_updates(UserOrderedUpdateProcessor(CONCURRENT_UPDATES))
+        .rate_limiter(OutboundLimiter(OUTBOUND_RATE))
+        .connection_pool_size(CONNECTION_POOL_SIZE)
+        .pool_timeout(POOL_TIMEOUT)
+        .build()
+    )
+
+    app.add_handler(CommandHandler("start", metrics.timed("/start", start)))
+    app.add_handler(CommandHandler("admin", metrics.timed("/admin", admin)))
+    app.add_handler(CommandHandler("reconcile", metrics.timed("/reconcile", reconcile)))
+    app.add_handler(CommandHandler("export", metrics.timed("/export", export)))
+    app.add_handler(CommandHandler("metrics", metrics.timed("/metrics", show_metrics)))
+
+    app.add_handler(CallbackQueryHandler(
+        metrics.timed(callback_route, admin_callback),
+        pattern="^(admin_|approve_|reject_|prize_)"
+    ))
+    app.add_handler(CallbackQueryHandler(metrics.timed(callback_route, callback_handler)))
+    app.add_handler(MessageHandler(
+        filters.ALL & ~filters.COMMAND,
+        metrics.timed(lambda update, context: f"state:{get_state(context)}", message_handler)
+    ))
+
+    return app
+
+async def run_bot(stop_event=None):
+    await init_db()
+
+    app = build_app()
 
     print("✅ NovaReach FULL PRO BOT ishga tushdi...")
 
     await app.initialize()
+    app.bot_data["referral_prefix"] = f"https://t.me/{app.bot.username}?start="
+
     await app.start()
-    await app.updater.start_polling()
+    register_gauges(app)
+
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = metrics.MetricsServer(METRICS_LISTEN, METRICS_PORT)
+        await metrics_server.start()
+
+    webhook_server = None
+    if WEBHOOK_URL:
+        webhook_server = WebhookServer(
+            app,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET
+        )
+        await webhook_server.start()
+        await app.bot.set_webhook(
+            url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        await app.updater.start_polling()
 
-    await asyncio.Event().wait()
+    await resume_broadcasts(app)
+    await ad_scheduler.start(app)
+
+    try:
+        await (stop_event or asyncio.Event()).wait()
+    finally:
+        await ad_scheduler.stop()
+        await stop_broadcasts()
+        if metrics_server:
+            await metrics_server.stop()
+        if webhook_server:
+            await webhook_server.stop()
+        else:
+            await app.updater.stop()
+        await app.stop()
+        await app.shutdown()
+        await close_db()
 
 
 if __name__ == "__main__":
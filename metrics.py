@@ -0,0 +1,199 @@
+import bisect
+import time
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+started_at = time.time()
+
+
+def _register(metric):
+    # re-registering a name (e.g. gauges bound to a new application) replaces it
+    _registry[:] = [m for m in _registry if m.name != metric.name]
+    _registry.append(metric)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format(name, label_names, label_values, value):
+    if label_names:
+        pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(label_names, label_values))
+        return f"{name}{{{pairs}}} {value}"
+    return f"{name} {value}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        _register(self)
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def total(self):
+        return sum(self._values.values())
+
+    def items(self):
+        return self._values.items()
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield _format(self.name, self.labels, labels, value)
+
+
+class Gauge:
+    kind = "gauge"
+
+    # fn returns a number, or {label values tuple: number} when labels are set;
+    # kind="counter" exposes a running total kept elsewhere (e.g. cache hits)
+    def __init__(self, name, description, fn, labels=(), kind="gauge"):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.fn = fn
+        self.kind = kind
+        _register(self)
+
+    def samples(self):
+        value = self.fn()
+        if not self.labels:
+            yield _format(self.name, (), (), value)
+            return
+        for labels, item in value.items():
+            yield _format(self.name, self.labels, labels, item)
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts (last one is +Inf), sum, count]
+        self._values = {}
+        _register(self)
+
+    def observe(self, value, *labels):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def items(self):
+        return self._values.items()
+
+    def quantile(self, q, *labels):
+        state = self._values.get(labels)
+        if not state or not state[2]:
+            return 0.0
+
+        rank = q * state[2]
+        seen = 0
+        for bound, count in zip(self.buckets, state[0]):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def samples(self):
+        names = (*self.labels, "le")
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                yield _format(f"{self.name}_bucket", names, (*labels, bound), cumulative)
+            yield _format(f"{self.name}_bucket", names, (*labels, "+Inf"), count)
+            yield _format(f"{self.name}_sum", self.labels, labels, total)
+            yield _format(f"{self.name}_count", self.labels, labels, count)
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+# route is a fixed label or a function (update, context) -> label; labels
+# must come from a bounded set, never straight from user input
+def timed(route, handler):
+    async def wrapper(update, context):
+        label = route(update, context) if callable(route) else route
+        with HANDLER_SECONDS.time(label):
+            await handler(update, context)
+    return wrapper
+
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Handler run time by route.", ("route",))
+UPDATE_WAIT_SECONDS = Histogram(
+    "bot_update_wait_seconds", "Time an update waited for its user's turn and a free slot."
+)
+DB_SECONDS = Histogram(
+    "bot_db_seconds", "Time spent holding a database connection, by db.py function.", ("kind", "function")
+)
+DB_WAIT_SECONDS = Histogram("bot_db_wait_seconds", "Time waiting for a database connection.", ("kind",))
+TELEGRAM_REQUESTS = Counter("bot_telegram_requests_total", "Bot API requests by method.", ("method",))
+TELEGRAM_RETRY_AFTER = Counter("bot_telegram_retry_after_total", "429 RetryAfter answers by method.", ("method",))
+TELEGRAM_ERRORS = Counter("bot_telegram_errors_total", "Failed Bot API requests by method and error.", ("method", "error"))
+SUBSCRIPTION_ERRORS = Counter("bot_subscription_errors_total", "Failed channel membership checks.")
+
+
+class MetricsServer:
+    def __init__(self, listen="127.0.0.1", port=9090):
+        self.listen = listen
+        self.port = port
+        self.web_app = web.Application()
+        self.web_app.router.add_get("/metrics", self._handle_metrics)
+        self._runner = None
+
+    async def _handle_metrics(self, request):
+        return web.Response(
+            body=render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    async def start(self):
+        self._runner = web.AppRunner(self.web_app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
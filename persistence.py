@@ -0,0 +1,111 @@
+import asyncio
+import json
+import pickle
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db import load_bot_state, save_bot_state
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, update_interval=5, flush_delay=0.5):
+        super().__init__(
+            store_data=PersistenceInput(callback_data=False),
+            update_interval=update_interval
+        )
+        self.flush_delay = flush_delay
+        self._pending = {}
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+
+    @property
+    def pending_count(self):
+        return len(self._pending)
+
+    async def _load(self, kind, key_type=int):
+        rows = await load_bot_state(kind)
+        return {key_type(key): pickle.loads(data) for key, data in rows}
+
+    def _put(self, kind, key, data):
+        self._pending[(kind, str(key))] = data
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        await self._write_pending()
+
+    async def _write_pending(self):
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            rows = []
+            deletes = []
+            for (kind, key), data in pending.items():
+                if data is None:
+                    deletes.append((kind, key))
+                else:
+                    rows.append((kind, key, pickle.dumps(data, pickle.HIGHEST_PROTOCOL)))
+
+            try:
+                await save_bot_state(rows, deletes)
+            except BaseException:
+                for item, data in pending.items():
+                    self._pending.setdefault(item, data)
+                raise
+
+    async def get_user_data(self):
+        return await self._load("user")
+
+    async def get_chat_data(self):
+        return await self._load("chat")
+
+    async def get_bot_data(self):
+        data = await self._load("bot", str)
+        return data.get("bot", {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {
+            tuple(json.loads(key)): state
+            for key, state in (await self._load(f"conversation:{name}", str)).items()
+        }
+
+    async def update_conversation(self, name, key, new_state):
+        self._put(f"conversation:{name}", json.dumps(list(key)), new_state)
+
+    async def update_user_data(self, user_id, data):
+        self._put("user", user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._put("chat", chat_id, data)
+
+    async def update_bot_data(self, data):
+        self._put("bot", "bot", data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._put("user", user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._put("chat", chat_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self._write_pending()
@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import UPDATE_WAIT_SECONDS
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, concurrency=64, max_pending=10_000):
+        # PTB's semaphore only bounds how many updates may be waiting here;
+        # the real concurrency limit is applied after the per-user lock so a
+        # user with a backlog does not hold slots other users could use.
+        super().__init__(max_pending)
+        self.concurrency = concurrency
+        self._slots = asyncio.Semaphore(concurrency)
+        self._users = {}
+
+        self.queued = 0
+        self.max_queued = 0
+        self.running = 0
+        self.processed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @staticmethod
+    def _key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    def stats(self):
+        return {
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "running": self.running,
+            "users_waiting": len(self._users),
+            "processed": self.processed,
+            "avg_wait": self.wait_total / self.processed if self.processed else 0.0,
+            "max_wait": self.wait_max,
+        }
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        entry = None
+        if key is not None:
+            entry = self._users.get(key)
+            if entry is None:
+                entry = self._users[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+
+        queued_at = time.monotonic()
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        locked = False
+        started = False
+
+        try:
+            if entry is not None:
+                await entry[0].acquire()
+                locked = True
+
+            async with self._slots:
+                wait = time.monotonic() - queued_at
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+                UPDATE_WAIT_SECONDS.observe(wait)
+                self.queued -= 1
+                self.running += 1
+                started = True
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+                    self.processed += 1
+        finally:
+            if locked:
+                entry[0].release()
+            if not started:
+                self.queued -= 1
+                coroutine.close()
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._users[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
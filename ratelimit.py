@@ -0,0 +1,250 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import BaseRateLimiter
+
+from metrics import TELEGRAM_ERRORS, TELEGRAM_REQUESTS, TELEGRAM_RETRY_AFTER
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def try_acquire(self):
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._last = self._paused_until
+        self._tokens = 0
+
+
+class Rule:
+    __slots__ = ("rate", "capacity")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+
+
+class RateLimiter:
+    def __init__(self, rules, sweep_interval=60):
+        self.rules = rules
+        self.sweep_interval = sweep_interval
+        self.drops = {action: 0 for action in rules}
+        self._buckets = {action: {} for action in rules}
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def __len__(self):
+        return sum(len(buckets) for buckets in self._buckets.values())
+
+    def allow(self, action, key):
+        rule = self.rules[action]
+        buckets = self._buckets[action]
+        now = time.monotonic()
+
+        if now >= self._next_sweep:
+            self.sweep(now)
+
+        state = buckets.get(key)
+        if state is None:
+            tokens = rule.capacity
+        else:
+            tokens = min(rule.capacity, state[0] + (now - state[1]) * rule.rate)
+
+        if tokens < 1:
+            buckets[key] = (tokens, now)
+            self.drops[action] += 1
+            return False
+
+        buckets[key] = (tokens - 1, now)
+        return True
+
+    def sweep(self, now=None):
+        now = now if now is not None else time.monotonic()
+        self._next_sweep = now + self.sweep_interval
+
+        for action, buckets in self._buckets.items():
+            rule = self.rules[action]
+            idle = [
+                key for key, (tokens, last) in buckets.items()
+                if tokens + (now - last) * rule.rate >= rule.capacity
+            ]
+            for key in idle:
+                del buckets[key]
+
+
+class PriorityTokenBucket(TokenBucket):
+    def __init__(self, rate, capacity=None):
+        super().__init__(rate, capacity)
+        self._waiters = []
+        self._seq = itertools.count()
+        self._dispatcher = None
+
+    def __len__(self):
+        return len(self._waiters)
+
+    async def acquire(self, priority=0):
+        if not self._waiters and self.try_acquire():
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        while self._waiters:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._refill(now)
+            while self._tokens >= 1 and self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if future.done():
+                    continue
+                self._tokens -= 1
+                future.set_result(None)
+
+            if self._waiters:
+                await asyncio.sleep(max(1 - self._tokens, 0) / self.rate)
+
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+MESSAGE_ENDPOINTS = {
+    "sendMessage",
+    "sendPhoto",
+    "sendDocument",
+    "sendVideo",
+    "sendAnimation",
+    "sendMediaGroup",
+    "copyMessage",
+    "forwardMessage",
+    "editMessageText",
+    "editMessageCaption",
+}
+
+
+class OutboundLimiter(BaseRateLimiter):
+    def __init__(
+        self,
+        overall_rate=30,
+        private_rule=Rule(rate=1, capacity=3),
+        group_rule=Rule(rate=20 / 60, capacity=20),
+        max_retries=3,
+        sweep_interval=60
+    ):
+        self.overall = PriorityTokenBucket(overall_rate)
+        self.private_rule = private_rule
+        self.group_rule = group_rule
+        self.max_retries = max_retries
+        self.sweep_interval = sweep_interval
+        self.requests = 0
+        self.retry_afters = 0
+        self._chats = {}
+        self._next_sweep = 0.0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rule = self.group_rule if is_group else self.private_rule
+            # chat buckets honour priority too, so an admin's own replies are
+            # not stuck behind queued bulk notifications to the same chat
+            bucket = self._chats[chat_id] = PriorityTokenBucket(rule.rate, rule.capacity)
+        return bucket
+
+    def _sweep(self, now):
+        self._next_sweep = now + self.sweep_interval
+        idle = [
+            chat_id for chat_id, bucket in self._chats.items()
+            if not bucket._waiters
+            and bucket._tokens + (now - bucket._last) * bucket.rate >= bucket.capacity
+        ]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = rate_limit_args if rate_limit_args is not None else PRIORITY_INTERACTIVE
+        limited = endpoint in MESSAGE_ENDPOINTS
+
+        chat_id = data.get("chat_id")
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        for attempt in range(self.max_retries + 1):
+            if limited:
+                if chat_id is not None:
+                    await self._chat_bucket(chat_id).acquire(priority)
+                await self.overall.acquire(priority)
+
+            self.requests += 1
+            TELEGRAM_REQUESTS.inc(endpoint)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_afters += 1
+                TELEGRAM_RETRY_AFTER.inc(endpoint)
+                if attempt == self.max_retries:
+                    TELEGRAM_ERRORS.inc(endpoint, type(e).__name__)
+                    raise
+                # Flood control is applied to the whole bot, so hold every
+                # outgoing message until it has passed, not just this chat.
+                self.overall.pause(e.retry_after + 0.1)
+                if not limited:
+                    await asyncio.sleep(e.retry_after + 0.1)
+            except TelegramError as e:
+                TELEGRAM_ERRORS.inc(endpoint, type(e).__name__)
+                raise
@@ -0,0 +1,239 @@
+"""Time db.py functions against generated databases of increasing size.
+
+    python -m tools.db_bench
+    python -m tools.db_bench --sizes 10000,100000,1000000 --output bench_output.txt
+
+Each size gets a fresh database in a temp directory with N users and N/10
+ad orders. For every function the report shows ops/sec, mean latency and
+the peak Python allocation of a single call.
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import db
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+INSERT_CHUNK = 50_000
+STATUSES = ("pending", "waiting_admin", "approved", "rejected", "expired")
+
+
+def _user_rows(count, rng):
+    for user_id in range(1, count + 1):
+        invited_by = rng.randint(1, user_id) if user_id > 1 and rng.random() < 0.3 else None
+        yield (
+            user_id,
+            f"user{user_id}",
+            f"User {user_id}",
+            int(rng.paretovariate(1.2)) - 1,
+            invited_by,
+            1 if rng.random() < 0.01 else 0,
+        )
+
+
+def _order_rows(count, users, rng):
+    for _ in range(count):
+        yield (
+            rng.randint(1, users),
+            rng.choice(("1 soat", "6 soat", "24 soat", "Pinned 24 soat")),
+            rng.choice((10000, 30000, 60000, 100000)),
+            "Reklama matni " * rng.randint(1, 20),
+            "receipt",
+            rng.choice(STATUSES),
+        )
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def populate(users, orders, seed):
+    rng = random.Random(seed)
+    await db.open_db()
+    await db.migrate()
+
+    for chunk in _chunks(_user_rows(users, rng), INSERT_CHUNK):
+        async with db._write("populate") as conn:
+            await conn.executemany(
+                "INSERT INTO users (user_id, username, first_name, points, invited_by, is_banned) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                chunk
+            )
+
+    for chunk in _chunks(_order_rows(orders, users, rng), INSERT_CHUNK):
+        async with db._write("populate") as conn:
+            await conn.executemany(
+                "INSERT INTO ads_orders (user_id, package, price, ad_text, receipt_file_id, status) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                chunk
+            )
+
+    async with db._write("populate") as conn:
+        await conn.execute("ANALYZE")
+    await db.close_db()
+
+
+async def deep_cursor(depth):
+    async with db._read("deep_cursor") as conn:
+        async with conn.execute(
+            "SELECT points, user_id FROM users ORDER BY points DESC, user_id DESC LIMIT 1 OFFSET ?",
+            (depth,)
+        ) as cur:
+            return tuple(await cur.fetchone())
+
+
+async def drain_export(table):
+    count = 0
+    async for rows in db.iter_export_rows(table):
+        count += len(rows)
+    return count
+
+
+def benchmarks(users, rng, cursor):
+    new_ids = iter(range(users + 1, users * 10))
+
+    async def add_users_batch():
+        await asyncio.gather(*(
+            db.add_user(next(new_ids), None, "New", rng.randint(1, users)) for _ in range(100)
+        ))
+
+    async def cold_user_points():
+        db.user_cache.clear()
+        await db.get_user_points(rng.randint(1, users))
+
+    return (
+        ("add_user (100 concurrent)", add_users_batch, 100),
+        ("add_points", lambda: db.add_points(rng.randint(1, users), 1), 1),
+        ("get_user_points (cached)", lambda: db.get_user_points(1), 1),
+        ("get_user_points (cold)", cold_user_points, 1),
+        ("is_banned", lambda: db.is_banned(rng.randint(1, users)), 1),
+        ("top_users", lambda: db.top_users(10), 1),
+        ("get_user_rank", lambda: db.get_user_rank(rng.randint(1, users)), 1),
+        ("get_users_page (first)", lambda: db.get_users_page(per_page=10), 1),
+        ("get_users_page (deep)", lambda: db.get_users_page(cursor, per_page=10), 1),
+        ("get_users_page (deep, back)", lambda: db.get_users_page(cursor, per_page=10, backward=True), 1),
+        ("total_users", db.total_users, 1),
+        ("get_menu_snapshot", lambda: db.get_menu_snapshot(rng.randint(1, users)), 1),
+        ("get_admin_snapshot", db.get_admin_snapshot, 1),
+        ("get_waiting_order_ids", lambda: db.get_waiting_order_ids(0, 5), 1),
+        ("get_ads_order", lambda: db.get_ads_order(rng.randint(1, max(users // 10, 1))), 1),
+        ("set_banned_bulk (100 ids)", lambda: db.set_banned_bulk(rng.sample(range(1, users + 1), 100), 0), 100),
+        ("get_all_users", db.get_all_users, None),
+        ("export users (stream)", lambda: drain_export("users"), None),
+    )
+
+
+async def measure(fn, min_time):
+    await fn()
+
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        await fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+
+    tracemalloc.start()
+    await fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return calls, elapsed, peak
+
+
+def _mb(value):
+    return value / (1024 * 1024)
+
+
+def _max_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss * 1024 if sys.platform != "darwin" else rss
+
+
+def reset_state():
+    # db.py keeps its cache and write batch at module level; without this a
+    # size would answer reads from records cached against the previous size
+    db.user_cache.clear()
+    db.user_cache.hits = db.user_cache.misses = 0
+    db._batch = db._WriteBatch()
+
+
+async def run_size(users, args, out):
+    reset_state()
+    with tempfile.TemporaryDirectory() as workdir:
+        db.DB_NAME = os.path.join(workdir, "database.db")
+
+        start = time.perf_counter()
+        await populate(users, users // 10, args.seed)
+        populate_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await db.init_db()
+        load_time = time.perf_counter() - start
+
+        rng = random.Random(args.seed)
+        cursor = await deep_cursor(min(users - 1, users // 2))
+
+        out(f"\n== {users:,} users / {users // 10:,} orders ==")
+        out(
+            f"populate {populate_time:.1f}s, init_db {load_time:.2f}s, "
+            f"db file {_mb(os.path.getsize(db.DB_NAME)):.1f} MB, max RSS {_mb(_max_rss()):.0f} MB"
+        )
+        out(f"{'function':<30}{'ops/s':>12}{'mean ms':>10}{'rows/s':>12}{'peak KB':>10}")
+
+        for name, fn, rows in benchmarks(users, rng, cursor):
+            min_time = args.min_time if rows is not None else 0
+            calls, elapsed, peak = await measure(fn, min_time)
+            ops = calls / elapsed
+            rows_per_sec = f"{ops * rows:,.0f}" if rows else "-"
+            out(f"{name:<30}{ops:>12,.1f}{elapsed / calls * 1000:>10.3f}{rows_per_sec:>12}{peak / 1024:>10.1f}")
+
+        await db.close_db()
+
+
+async def run(args):
+    lines = []
+
+    def out(line):
+        print(line, flush=True)
+        lines.append(line)
+
+    for users in args.sizes:
+        await run_size(users, args, out)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=list(DEFAULT_SIZES),
+        help="comma separated user counts"
+    )
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds to run each function for")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the report to this file")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+from aiohttp import ClientSession, web
+
+BOT_USER = {
+    "id": 100000,
+    "is_bot": True,
+    "first_name": "Fake Bot",
+    "username": "fake_reklama_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+
+def _decode(value):
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class FakeTelegram:
+    def __init__(self, host="127.0.0.1", port=8081, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.calls = []
+        self.counts = Counter()
+        self.blocked_chats = set()
+        self.non_members = set()
+        self.flood_every = 0
+        self.retry_after = 1
+        self.webhook = None
+        self.files = {}
+        self._message_ids = itertools.count(1)
+        self._runner = None
+
+        self.web_app = web.Application(client_max_size=50 * 1024 * 1024)
+        self.web_app.router.add_post("/bot{token}/{method}", self._handle)
+        self.web_app.router.add_get("/file/bot{token}/{file_id}", self._handle_file)
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._runner = web.AppRunner(self.web_app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def reset(self):
+        self.calls.clear()
+        self.counts.clear()
+
+    def calls_to(self, method):
+        return [params for name, params in self.calls if name == method]
+
+    async def _params(self, request):
+        if request.content_type == "application/json":
+            return await request.json()
+
+        form = await request.post()
+        return {
+            key: _decode(value) if isinstance(value, str) else value
+            for key, value in form.items()
+        }
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        params = await self._params(request)
+
+        self.calls.append((method, params))
+        self.counts[method] += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.flood_every and self.counts[method] % self.flood_every == 0:
+            return self._error(429, f"Too Many Requests: retry after {self.retry_after}",
+                               {"retry_after": self.retry_after})
+
+        chat_id = params.get("chat_id")
+        if chat_id in self.blocked_chats:
+            return self._error(403, "Forbidden: bot was blocked by the user")
+
+        handler = getattr(self, f"_method_{method.lower()}", None)
+        result = handler(params) if handler else True
+        if asyncio.iscoroutine(result):
+            result = await result
+        if isinstance(result, web.Response):
+            return result
+        return web.json_response({"ok": True, "result": result})
+
+    async def _handle_file(self, request):
+        data = self.files.get(request.match_info["file_id"])
+        if data is None:
+            return web.Response(status=404)
+        return web.Response(body=data)
+
+    def _error(self, code, description, parameters=None):
+        body = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=code)
+
+    def _message(self, params, **extra):
+        chat_id = params.get("chat_id")
+        if isinstance(chat_id, str) and chat_id.startswith("@"):
+            chat = {"id": -1000000000001, "type": "channel", "title": chat_id, "username": chat_id[1:]}
+        else:
+            chat = {"id": int(chat_id), "type": "private" if int(chat_id) > 0 else "supergroup"}
+
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": chat,
+            "from": BOT_USER,
+            **extra,
+        }
+
+    def _method_getme(self, params):
+        return BOT_USER
+
+    def _method_getupdates(self, params):
+        return asyncio.sleep(min(float(params.get("timeout") or 0), 1), result=[])
+
+    def _method_setwebhook(self, params):
+        self.webhook = params
+        return True
+
+    def _method_deletewebhook(self, params):
+        self.webhook = None
+        return True
+
+    def _method_sendmessage(self, params):
+        return self._message(params, text=str(params.get("text", "")))
+
+    def _method_editmessagetext(self, params):
+        return self._message(params, text=str(params.get("text", "")))
+
+    def _method_sendphoto(self, params):
+        photo = [{"file_id": str(params.get("photo")), "file_unique_id": "p", "width": 1, "height": 1}]
+        return self._message(params, photo=photo, caption=params.get("caption"))
+
+    def _method_senddocument(self, params):
+        document = {"file_id": "document", "file_unique_id": "d"}
+        return self._message(params, document=document, caption=params.get("caption"))
+
+    def _method_getfile(self, params):
+        file_id = str(params["file_id"])
+        if file_id not in self.files:
+            return self._error(400, "Bad Request: invalid file_id")
+        return {
+            "file_id": file_id,
+            "file_unique_id": file_id,
+            "file_size": len(self.files[file_id]),
+            "file_path": file_id,
+        }
+
+    def _method_getchatmember(self, params):
+        user_id = int(params["user_id"])
+        status = "left" if user_id in self.non_members else "member"
+        return {"status": status, "user": {"id": user_id, "is_bot": False, "first_name": "User"}}
+
+
+_update_ids = itertools.count(1)
+
+
+def _user(user_id, first_name):
+    return {"id": user_id, "is_bot": False, "first_name": first_name, "username": f"user{user_id}"}
+
+
+def message_update(user_id, text=None, photo=None, document=None, first_name="User"):
+    message = {
+        "message_id": next(_update_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id, first_name),
+    }
+
+    if text is not None:
+        message["text"] = text
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+
+    if photo is not None:
+        message["photo"] = [{"file_id": photo, "file_unique_id": photo, "width": 1, "height": 1}]
+
+    if document is not None:
+        message["document"] = {"file_id": document, "file_unique_id": document, "file_name": f"{document}.csv"}
+
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def callback_update(user_id, data, first_name="User"):
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id, first_name),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": next(_update_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "menu",
+            },
+        },
+    }
+
+
+async def post_update(session: ClientSession, url, update, secret_token=None):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret_token} if secret_token else {}
+    async with session.post(url, json=update, headers=headers) as response:
+        return response.status
@@ -0,0 +1,285 @@
+"""Drive the bot with synthetic or recorded updates against a local fake Bot API.
+
+    python -m tools.loadtest --users 2000 --updates 10000 --rate 500
+    python -m tools.loadtest --updates 5000 --record updates.jsonl
+    python -m tools.loadtest --replay updates.jsonl --rate 200
+
+Reports throughput, handler and end-to-end latency percentiles, time spent
+holding database connections and the Bot API calls the bot made.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+
+from aiohttp import ClientSession, TCPConnector
+
+from tools.fake_telegram import FakeTelegram, callback_update, message_update, post_update
+from tools.webhook_e2e import ADMIN_ID, WEBHOOK_SECRET, configure_env, wait_for
+
+BASE_USER_ID = 1_000_000
+
+USER_CALLBACKS = ("profile", "top", "stats_user", "referral", "giveaway", "ads_menu")
+ADMIN_CALLBACKS = ("admin_users_1", "admin_ads", "admin_ads_reset")
+
+
+def synthetic_updates(users, count, admin_share=0.01, seed=1):
+    rng = random.Random(seed)
+    started = []
+    updates = []
+
+    while len(updates) < count:
+        if not started or (len(started) < users and rng.random() < 0.3):
+            user_id = BASE_USER_ID + len(started)
+            inviter = rng.choice(started) if started and rng.random() < 0.6 else None
+            text = f"/start {inviter}" if inviter else "/start"
+            started.append(user_id)
+            updates.append(message_update(user_id, text, first_name=f"User {user_id}"))
+        elif rng.random() < admin_share:
+            if rng.random() < 0.2:
+                updates.append(message_update(ADMIN_ID, "/admin"))
+            else:
+                updates.append(callback_update(ADMIN_ID, rng.choice(ADMIN_CALLBACKS)))
+        elif rng.random() < 0.05:
+            user_id = rng.choice(started)
+            updates.append(callback_update(user_id, rng.choice(("ads_1h", "ads_6h", "ads_24h", "ads_pin"))))
+            updates.append(message_update(user_id, f"Reklama matni {user_id}"))
+            updates.append(message_update(user_id, photo=f"receipt-{user_id}"))
+        else:
+            updates.append(callback_update(rng.choice(started), rng.choice(USER_CALLBACKS)))
+
+    return updates[:count]
+
+
+def load_updates(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_updates(path, updates):
+    with open(path, "w", encoding="utf-8") as f:
+        for update in updates:
+            f.write(json.dumps(update, ensure_ascii=False) + "\n")
+
+
+def label(update):
+    if update.callback_query:
+        return "callback:" + re.sub(r"_\d.*$", "", update.callback_query.data or "")
+    message = update.effective_message
+    if message and message.text and message.text.startswith("/"):
+        return "command:" + message.text.split()[0][1:]
+    if message and message.photo:
+        return "message:photo"
+    return "message:text"
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+class Recorder:
+    def __init__(self):
+        self.handler = defaultdict(list)
+        self.end_to_end = []
+        self.db = defaultdict(list)
+        self.posted_at = {}
+        self.done = 0
+        self.limiter = None
+
+    def instrument_db(self, db):
+        for name in ("_read", "_write"):
+            original = getattr(db, name)
+            setattr(db, name, self._timed_connection(original, name[1:]))
+
+    def _timed_connection(self, original, kind):
+        samples = self.db[kind]
+
+        @asynccontextmanager
+        async def timed(function):
+            start = time.perf_counter()
+            try:
+                async with original(function) as conn:
+                    yield conn
+            finally:
+                samples.append(time.perf_counter() - start)
+
+        return timed
+
+    def instrument_processor(self, processor):
+        original = processor.do_process_update
+
+        async def timed_update(update, coroutine):
+            await original(update, self._timed_handler(update, coroutine))
+
+        processor.do_process_update = timed_update
+
+    async def _timed_handler(self, update, coroutine):
+        start = time.perf_counter()
+        try:
+            await coroutine
+        finally:
+            end = time.perf_counter()
+            self.handler[label(update)].append(end - start)
+            posted = self.posted_at.pop(update.update_id, None)
+            if posted is not None:
+                self.end_to_end.append(end - posted)
+            self.done += 1
+
+
+async def seed_users(db, count):
+    if not count:
+        return
+    await db.init_db()
+    async with db._write("seed_users") as conn:
+        await conn.executemany(
+            "INSERT INTO users (user_id, username, first_name, points) VALUES (?, ?, ?, ?)",
+            ((i, f"seed{i}", f"Seed {i}", i % 1000) for i in range(1, count + 1))
+        )
+    await db.close_db()
+
+
+async def drive(url, updates, rate, recorder, connections):
+    semaphore = asyncio.Semaphore(connections)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async with ClientSession(connector=TCPConnector(limit=connections)) as session:
+        async def post(update):
+            async with semaphore:
+                recorder.posted_at[update["update_id"]] = time.perf_counter()
+                await post_update(session, url, update, WEBHOOK_SECRET)
+
+        tasks = []
+        for i, update in enumerate(updates):
+            if rate:
+                delay = start + i / rate - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post(update)))
+        await asyncio.gather(*tasks)
+
+
+def report(recorder, fake, elapsed, total, flood_limiter):
+    ms = 1000
+    print(f"\nupdates: {recorder.done}/{total} in {elapsed:.2f}s  ->  {recorder.done / elapsed:.1f} updates/s")
+
+    e2e = recorder.end_to_end
+    print(
+        f"end-to-end ms: p50={percentile(e2e, 50) * ms:.1f} "
+        f"p95={percentile(e2e, 95) * ms:.1f} p99={percentile(e2e, 99) * ms:.1f}"
+    )
+
+    print("\nhandler latency (ms)")
+    print(f"  {'route':<28}{'count':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, samples in sorted(recorder.handler.items(), key=lambda item: -len(item[1])):
+        print(
+            f"  {name:<28}{len(samples):>8}"
+            f"{percentile(samples, 50) * ms:>9.1f}{percentile(samples, 95) * ms:>9.1f}"
+            f"{percentile(samples, 99) * ms:>9.1f}"
+        )
+
+    print("\ndatabase (time holding a connection)")
+    for kind, samples in sorted(recorder.db.items()):
+        print(
+            f"  {kind:<6} count={len(samples)} total={sum(samples):.2f}s "
+            f"p50={percentile(samples, 50) * ms:.2f}ms p99={percentile(samples, 99) * ms:.2f}ms"
+        )
+
+    print("\nBot API calls")
+    for method, count in Counter(fake.counts).most_common():
+        print(f"  {method:<24}{count:>8}")
+
+    print(f"\nflood drops: {dict(flood_limiter.drops)}")
+    limiter = recorder.limiter
+    if limiter is not None:
+        print(f"outbound requests: {limiter.requests}  retry_after: {limiter.retry_afters}")
+
+
+async def run(args, workdir):
+    fake = FakeTelegram(latency=args.api_latency / 1000)
+    fake.flood_every = args.flood_every
+    await fake.start()
+
+    os.environ["OUTBOUND_RATE"] = str(args.outbound_rate)
+    configure_env(fake.url, workdir)
+
+    import db
+    import main
+
+    recorder = Recorder()
+    recorder.instrument_db(db)
+    await seed_users(db, args.seed_users)
+
+    if args.replay:
+        updates = load_updates(args.replay)
+    else:
+        updates = synthetic_updates(args.users, args.updates, seed=args.seed)
+    if args.record:
+        save_updates(args.record, updates)
+
+    build_app = main.build_app
+
+    def instrumented_build_app():
+        app = build_app()
+        recorder.instrument_processor(app.update_processor)
+        recorder.limiter = app.bot.rate_limiter
+        return app
+
+    main.build_app = instrumented_build_app
+
+    stop = asyncio.Event()
+    bot_task = asyncio.create_task(main.run_bot(stop))
+
+    try:
+        await wait_for(lambda: fake.webhook is not None, timeout=10)
+        fake.reset()
+        for samples in recorder.db.values():
+            samples.clear()
+
+        url = f"http://127.0.0.1:{main.WEBHOOK_PORT}{main.WEBHOOK_PATH}"
+        started = time.perf_counter()
+        await drive(url, updates, args.rate, recorder, args.connections)
+        try:
+            await wait_for(lambda: recorder.done >= len(updates), timeout=args.timeout)
+        except TimeoutError:
+            print(f"timed out with {len(updates) - recorder.done} updates still pending")
+        elapsed = time.perf_counter() - started
+    finally:
+        stop.set()
+        await bot_task
+        await fake.stop()
+
+    report(recorder, fake, elapsed, len(updates), main.flood_limiter)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="distinct synthetic users")
+    parser.add_argument("--updates", type=int, default=5000, help="synthetic updates to send")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--seed-users", type=int, default=0, help="rows to pre-populate the users table with")
+    parser.add_argument("--rate", type=float, default=0, help="updates per second, 0 = as fast as possible")
+    parser.add_argument("--connections", type=int, default=100, help="concurrent webhook requests")
+    parser.add_argument("--replay", help="JSONL file of raw updates to replay")
+    parser.add_argument("--record", help="write the updates that are sent to this JSONL file")
+    parser.add_argument("--api-latency", type=float, default=0, help="fake Bot API latency in ms")
+    parser.add_argument("--flood-every", type=int, default=0, help="answer every Nth call of a method with 429")
+    parser.add_argument("--outbound-rate", type=float, default=100_000, help="OUTBOUND_RATE for the bot")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(run(args, workdir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Run the bot in webhook mode against a local fake Bot API and check a few flows.
+
+    python -m tools.webhook_e2e
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+from aiohttp import ClientSession
+
+from tools.fake_telegram import FakeTelegram, callback_update, message_update, post_update
+
+ADMIN_ID = 1
+WEBHOOK_PORT = 8443
+WEBHOOK_SECRET = "e2e-secret"
+METRICS_PORT = 9464
+
+
+def configure_env(api_url, workdir):
+    os.environ.update({
+        "BOT_TOKEN": "123:e2e",
+        "ADMIN_ID": str(ADMIN_ID),
+        "CHANNEL_USERNAME": "@e2e_channel",
+        "TELEGRAM_API_URL": api_url,
+        "WEBHOOK_URL": f"http://127.0.0.1:{WEBHOOK_PORT}",
+        "WEBHOOK_LISTEN": "127.0.0.1",
+        "WEBHOOK_PORT": str(WEBHOOK_PORT),
+        "WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "METRICS_PORT": str(METRICS_PORT),
+    })
+
+    import db
+    db.DB_NAME = os.path.join(workdir, "database.db")
+
+
+async def wait_for(predicate, timeout=5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        if loop.time() > deadline:
+            raise TimeoutError("condition not met")
+        await asyncio.sleep(0.02)
+
+
+async def run(workdir):
+    fake = FakeTelegram()
+    await fake.start()
+    configure_env(fake.url, workdir)
+
+    import main
+
+    stop = asyncio.Event()
+    bot_task = asyncio.create_task(main.run_bot(stop))
+    failures = []
+
+    try:
+        await wait_for(lambda: fake.webhook is not None)
+        url = f"http://127.0.0.1:{WEBHOOK_PORT}{main.WEBHOOK_PATH}"
+
+        async with ClientSession() as session:
+            status = await post_update(session, url, message_update(42, "/start"), "wrong")
+            if status != 403:
+                failures.append(f"wrong secret accepted: {status}")
+
+            await post_update(session, url, message_update(42, "/start"), WEBHOOK_SECRET)
+            await wait_for(lambda: any(p.get("chat_id") == 42 for p in fake.calls_to("sendMessage")))
+
+            menu = fake.calls_to("sendMessage")[-1]["text"]
+            if "fake_reklama_bot?start=42" not in menu:
+                failures.append("menu has no referral link")
+
+            await post_update(session, url, callback_update(42, "profile"), WEBHOOK_SECRET)
+            await wait_for(lambda: any("Profil" in str(p.get("text")) for p in fake.calls_to("sendMessage")))
+
+            await post_update(session, url, callback_update(42, "ads_1h"), WEBHOOK_SECRET)
+            await wait_for(lambda: any("reklama matnini" in str(p.get("text")) for p in fake.calls_to("sendMessage")))
+            await post_update(session, url, message_update(42, "Buy now"), WEBHOOK_SECRET)
+            await wait_for(lambda: any("chek" in str(p.get("text")) for p in fake.calls_to("sendMessage")))
+            await post_update(session, url, message_update(42, photo="receipt-1"), WEBHOOK_SECRET)
+            await wait_for(lambda: any(p.get("chat_id") == ADMIN_ID for p in fake.calls_to("sendPhoto")))
+            await post_update(session, url, callback_update(ADMIN_ID, "admin_ads"), WEBHOOK_SECRET)
+            await wait_for(lambda: any("ko‘rsatildi" in str(p.get("text")) for p in fake.calls_to("sendMessage")))
+            if len(fake.calls_to("sendPhoto")) != 2:
+                failures.append("review queue did not send the waiting order")
+
+            await post_update(session, url, callback_update(ADMIN_ID, "admin_ads"), WEBHOOK_SECRET)
+            await wait_for(lambda: any("Yangi reklama" in str(p.get("text")) for p in fake.calls_to("sendMessage")))
+            if len(fake.calls_to("sendPhoto")) != 2:
+                failures.append("review queue re-sent an order already shown")
+
+            await post_update(session, url, callback_update(ADMIN_ID, "approve_1"), WEBHOOK_SECRET)
+            await wait_for(lambda: any(p.get("chat_id") == "@e2e_channel" for p in fake.calls_to("sendMessage")))
+
+            await post_update(session, url, message_update(ADMIN_ID, "/admin"), WEBHOOK_SECRET)
+            await wait_for(lambda: any("ADMIN PANEL" in str(p.get("text")) for p in fake.calls_to("sendMessage")))
+
+            await post_update(session, url, callback_update(ADMIN_ID, "admin_add_points"), WEBHOOK_SECRET)
+            await wait_for(lambda: any("user_id ball" in str(p.get("text")) for p in fake.calls_to("sendMessage")))
+            await post_update(session, url, message_update(ADMIN_ID, "42 5\n999 1\nxyz"), WEBHOOK_SECRET)
+            await wait_for(lambda: any("Ball qo‘shildi" in str(p.get("text")) for p in fake.calls_to("sendMessage")))
+            report = fake.calls_to("sendMessage")[-1]["text"]
+            if "42 5 — ✅" not in report or "999 1 — ❓" not in report or "xyz — ❌" not in report:
+                failures.append(f"unexpected bulk points report: {report!r}")
+
+            fake.files["ban-list"] = b"user_id\n42\n4242\n"
+            await post_update(session, url, callback_update(ADMIN_ID, "admin_ban"), WEBHOOK_SECRET)
+            await wait_for(lambda: any("Ban qilinadigan" in str(p.get("text")) for p in fake.calls_to("sendMessage")))
+            await post_update(session, url, message_update(ADMIN_ID, document="ban-list"), WEBHOOK_SECRET)
+            await wait_for(lambda: any("Ban natijasi" in str(p.get("text")) for p in fake.calls_to("sendMessage")))
+            report = fake.calls_to("sendMessage")[-1]["text"]
+            if "42 — ✅" not in report or "4242 — ❓" not in report:
+                failures.append(f"unexpected bulk ban report: {report!r}")
+
+            await post_update(session, url, message_update(ADMIN_ID, "/export orders jsonl"), WEBHOOK_SECRET)
+            await wait_for(lambda: fake.calls_to("sendDocument"))
+            if "ads_orders: 1 ta qator" not in str(fake.calls_to("sendDocument")[-1].get("caption")):
+                failures.append("export did not send the orders file")
+
+            await post_update(session, url, message_update(ADMIN_ID, "/metrics"), WEBHOOK_SECRET)
+            await wait_for(lambda: any("METRIKALAR" in str(p.get("text")) for p in fake.calls_to("sendMessage")))
+
+            async with session.get(f"http://127.0.0.1:{METRICS_PORT}/metrics") as response:
+                exposition = await response.text()
+            for name in ("bot_handler_seconds_bucket", "bot_db_seconds_count", "bot_telegram_requests_total"):
+                if name not in exposition:
+                    failures.append(f"{name} missing from /metrics")
+
+            await post_update(session, url, message_update(43, "/start"), WEBHOOK_SECRET)
+            await post_update(session, url, callback_update(43, "ads_6h"), WEBHOOK_SECRET)
+            await wait_for(lambda: any(
+                p.get("chat_id") == 43 and "reklama matnini" in str(p.get("text"))
+                for p in fake.calls_to("sendMessage")
+            ))
+
+            # user_data has to survive a restart for the ad flow to go on
+            stop.set()
+            await bot_task
+            stop = asyncio.Event()
+            fake.webhook = None
+            bot_task = asyncio.create_task(main.run_bot(stop))
+            await wait_for(lambda: fake.webhook is not None)
+
+            await post_update(session, url, message_update(43, "Restart reklama"), WEBHOOK_SECRET)
+            await wait_for(lambda: any(
+                p.get("chat_id") == 43 and "chek" in str(p.get("text"))
+                for p in fake.calls_to("sendMessage")
+            ))
+    except TimeoutError as e:
+        failures.append(str(e))
+    finally:
+        stop.set()
+        await bot_task
+        await fake.stop()
+
+    print(f"Bot API calls: {dict(fake.counts)}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("OK" if not failures else "FAILED")
+    return not failures
+
+
+def main():
+    with tempfile.TemporaryDirectory() as workdir:
+        ok = asyncio.run(run(workdir))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import hmac
+
+from aiohttp import web
+from telegram import Update
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    def __init__(self, application, listen="0.0.0.0", port=8080, path="/telegram", secret_token=None):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.web_app = web.Application()
+        self.web_app.router.add_post(path, self._handle_update)
+        self.web_app.router.add_get("/healthz", self._handle_health)
+        self._runner = None
+
+    async def _handle_update(self, request):
+        if self.secret_token:
+            token = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(token, self.secret_token):
+                return web.Response(status=403)
+
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        update = Update.de_json(data, self.application.bot)
+        if update is None:
+            return web.Response(status=400)
+
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def _handle_health(self, request):
+        return web.Response(text="ok")
+
+    async def start(self):
+        self._runner = web.AppRunner(self.web_app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None